@@ -1,14 +1,9 @@
 import os
+import concurrent.futures
 import pandas as pd
-import pyarrow as pa 
-import pyarrow.parquet as pq 
-from tqdm import tqdm
 from datetime import datetime, timedelta
 import numpy as np
-import plotly.graph_objects as go
-import tkinter as tk
-from tkinter import filedialog
-from scipy.stats import zscore
+# pyarrow and scipy are imported in the functions that use them so that importing this module stays fast
 
 def time_to_seconds(t):
     """Summary: This function converts a time object to seconds
@@ -30,6 +25,7 @@ def load_from_parquet(file_name):
     Returns:
         pandas.DataFrame: The data frame read from the parquet file
     """
+    import pyarrow.parquet as pq
     # read the parquet file
     table = pq.read_table(file_name)
     # convert the table to a pandas data frame
@@ -70,6 +66,10 @@ def check_data(data_frame):
     
     #remove rows with missing data
     data_frame = data_frame.dropna()
+    # sort by date time once so that the time range helpers can use a binary search
+    if not data_frame['Date time'].is_monotonic_increasing:
+        data_frame = data_frame.sort_values(by='Date time', kind='stable')
+    data_frame = data_frame.reset_index(drop=True)
     return data_frame
 
 def get_workday(data_frame):
@@ -98,15 +98,24 @@ def remove_daily_out_work_hours(data_frame, workdays):
     """Summary: This function removes data outside of work hours for each workday in the data frame
 
     Args:
-        data_frame (pandas.DataFrame): The data frame to remove data from
+        data_frame (pandas.DataFrame): The data frame to remove data from, sorted by 'Date time'
         workdays (dict): A dictionary with dates as keys and tuples of start and end times as values
 
     Returns:
         pandas.DataFrame: The data frame with data outside of work hours removed
     """
-    # gorup dataframe by date and remove data outside of work hours using the remove_out_work_hours function
-    data_frame = data_frame.groupby(data_frame['Date time'].dt.date).apply(remove_out_work_hours, workdays)
-    
+    # for each day keep the rows between the start and end of the workday, days without a workday are kept as they are
+    # the bounds are found with a binary search on the sorted 'Date time' column instead of comparing every row
+    positions = []
+    for date, (start, stop) in get_daily_bounds(data_frame).items():
+        if date in workdays:
+            startTime = datetime.combine(date, workdays[date][0])
+            endTime = datetime.combine(date, workdays[date][1])
+            start, stop = get_time_bounds(data_frame, startTime, endTime, inclusive="both")
+        positions.append(np.arange(start, stop))
+    if len(positions) == 0:
+        return data_frame.reset_index(drop=True)
+    data_frame = data_frame.iloc[np.concatenate(positions)]
     # reset index
     data_frame = data_frame.reset_index(drop=True)
     return data_frame
@@ -130,41 +139,60 @@ def remove_out_work_hours(data_frame, workdays):
     data_frame = data_frame[(data_frame['Date time'].dt.time >= startTime) & (data_frame['Date time'].dt.time <= endTime)]
     return data_frame
 
-def resample_data(data_frame, resampling_period = 0):
-    """Summary: This function resamples the data frame to a specified period
+def smooth_distance(data_frame, smoothing_window = 15):
+    """Summary: This function suppresses isolated spikes of the distance sensor with a rolling median over a trailing time window.
+                Because the window is a duration and not a number of rows, it never reaches back across a recording gap longer than the window.
+                The data frame must be sorted by 'Date time' (see check_data).
+
+    Args:
+        data_frame (pandas.DataFrame): The data frame to smooth
+        smoothing_window (int, optional): The duration of the rolling window in seconds, 0 disables the smoothing. Defaults to 15.
+
+    Returns:
+        pandas.Series: The smoothed distance, aligned with the rows of the data frame
+    """
+    distance = data_frame['Distance(mm)']
+    if smoothing_window == 0 or data_frame.empty:
+        return distance
+    smoothed = pd.Series(distance.to_numpy(dtype=float), index=pd.DatetimeIndex(data_frame['Date time'])).rolling(f'{smoothing_window}s').median()
+    return pd.Series(smoothed.to_numpy(), index=data_frame.index, name='Distance(mm)')
+
+def resample_data(data_frame, resampling_period = 0, smoothing_window = 15):
+    """Summary: This function resamples the data frame to a specified period.
+                The distance is smoothed with smooth_distance, then every period is aggregated in a single grouped pass:
+                the mean of the distance and of the other numeric columns and the maximum of the boolean columns.
+                'Human Present' is first replaced by its minimum over a trailing window of resampling_period seconds, so a period is present
+                if the person was present for at least one full window ending in it (a window starting after a recording gap is shorter).
+                Periods without data, such as the time the device sleeps outside of its recording hours, are left out rather than bridged.
     
     Args:
-        data_frame (pandas.DataFrame): The data frame to resample
+        data_frame (pandas.DataFrame): The data frame to resample, sorted by 'Date time'
         resampling_period (int, optional): The period to resample the data to in seconds. Defaults to 0.
+        smoothing_window (int, optional): The duration in seconds of the rolling median applied to the distance before resampling. Defaults to 15.
         
     Returns:
         pandas.DataFrame: The resampled data frame
     """
     data_frame = data_frame.copy()
-    if resampling_period == 0:
+    if resampling_period == 0 or data_frame.empty:
         return data_frame
     #get columns that are boolean
     bool_cols = data_frame.select_dtypes(include=[bool]).columns
-    # compute sampling period base on date time of dta frame
-    period = data_frame['Date time'].diff().median()
-    if period.total_seconds() == 0:
-        return data_frame
-    # compute windows size so that the windo covers the resampling period
-    window_size = int(resampling_period/period.total_seconds())
-    # run rolling mean on distance and min on human present
-    data_frame['Distance(mm)'] = data_frame['Distance(mm)'].rolling(window=window_size).mean()
-    data_frame['Human Present'] = data_frame['Human Present'].rolling(window=window_size).min()
-    #convert human present to boolean
-    # set index
-    data_frame = data_frame.set_index('Date time')
-    # resample the data frame to the resampling period
-    data_frame = data_frame.resample(f'{resampling_period}s').mean()
-    # drop rows with missing values
-    data_frame = data_frame.dropna()
+    num_cols = data_frame.select_dtypes(include=[np.number]).columns
+    data_frame['Distance(mm)'] = smooth_distance(data_frame, smoothing_window)
+    if 'Human Present' in bool_cols:
+        # each row is present if the person was present over the trailing resampling period, the window is a duration
+        # so it does not reach back across a recording gap
+        present = pd.Series(data_frame['Human Present'].to_numpy(dtype=float), index=pd.DatetimeIndex(data_frame['Date time']))
+        data_frame['Human Present'] = present.rolling(f'{resampling_period}s').min().to_numpy()
+    # a period is present if at least one trailing window in it was present throughout, other flags if they were set at any point of the period
+    aggregations = {column: 'mean' for column in num_cols}
+    aggregations.update({column: 'max' for column in bool_cols})
+    # the start of the period each row falls in
+    periodStart = data_frame['Date time'].dt.floor(f'{resampling_period}s')
+    data_frame = data_frame[list(aggregations.keys())].groupby(periodStart.rename('Date time')).agg(aggregations)
     # reset index
     data_frame = data_frame.reset_index()
-    # # convert 'Human Present' to boolean
-    # data_frame['Human Present'] = np.where(data_frame['Human Present'] == 0, False, True)
     # convert boolean columns to boolean
     data_frame[bool_cols] = data_frame[bool_cols].astype('bool')
     return data_frame
@@ -184,8 +212,81 @@ def get_data_duration(data_frame):
     duration = end_time - start_time
     return duration
     
+def get_time_bounds(data_frame, start_datetime, end_datetime, inclusive="left"):
+    """Summary: This function finds the first and last row positions of a datetime range using a binary search on the 'Date time' column.
+                The data frame must be sorted by 'Date time' (see check_data).
+
+    Args:
+        data_frame (pandas.DataFrame): The data frame sorted by 'Date time'
+        start_datetime (datetime.datetime): The start of the range
+        end_datetime (datetime.datetime): The end of the range
+        inclusive (str, optional): Which ends of the range to include: "both", "neither", "left" or "right". Defaults to "left".
+
+    Returns:
+        tuple: The start and stop row positions of the range, to be used as data_frame.iloc[start:stop]
+    """
+    times = data_frame['Date time'].to_numpy()
+    startSide = 'left' if inclusive in ("both", "left") else 'right'
+    stopSide = 'right' if inclusive in ("both", "right") else 'left'
+    start = int(np.searchsorted(times, np.datetime64(pd.Timestamp(start_datetime)), side=startSide))
+    stop = int(np.searchsorted(times, np.datetime64(pd.Timestamp(end_datetime)), side=stopSide))
+    return start, max(start, stop)
+
+def get_time_slice(data_frame, start_datetime, end_datetime, inclusive="left"):
+    """Summary: This function returns the rows of the data frame within a datetime range without scanning the whole data frame.
+                The data frame must be sorted by 'Date time' (see check_data).
+
+    Args:
+        data_frame (pandas.DataFrame): The data frame sorted by 'Date time'
+        start_datetime (datetime.datetime): The start of the range
+        end_datetime (datetime.datetime): The end of the range
+        inclusive (str, optional): Which ends of the range to include: "both", "neither", "left" or "right". Defaults to "left".
+
+    Returns:
+        pandas.DataFrame: A positional slice of the data frame containing only the rows in the range
+    """
+    start, stop = get_time_bounds(data_frame, start_datetime, end_datetime, inclusive)
+    return data_frame.iloc[start:stop]
+
+def get_daily_bounds(data_frame):
+    """Summary: This function computes the start and stop row positions of every date in the data frame in a single binary search.
+                The data frame must be sorted by 'Date time' (see check_data).
+
+    Args:
+        data_frame (pandas.DataFrame): The data frame sorted by 'Date time'
+
+    Returns:
+        dict: A dictionary with dates as keys and tuples of start and stop row positions as values, dates without data are left out
+    """
+    times = data_frame['Date time'].to_numpy()
+    if len(times) == 0:
+        return {}
+    # midnight of every date between the first and the last sample, plus the midnight after the last date
+    firstDay = times[0].astype('datetime64[D]')
+    lastDay = times[-1].astype('datetime64[D]')
+    midnights = np.arange(firstDay, lastDay + np.timedelta64(2, 'D'))
+    edges = np.searchsorted(times, midnights.astype(times.dtype), side='left')
+    dailyBounds = {}
+    for day, start, stop in zip(midnights[:-1], edges[:-1], edges[1:]):
+        if stop > start:
+            dailyBounds[day.astype(object)] = (int(start), int(stop))
+    return dailyBounds
+
+def get_daily_slices(data_frame):
+    """Summary: This function splits the data frame into one positional slice per date without grouping the whole data frame.
+                The data frame must be sorted by 'Date time' (see check_data).
+
+    Args:
+        data_frame (pandas.DataFrame): The data frame sorted by 'Date time'
+
+    Returns:
+        dict: A dictionary with dates as keys and the data frame slice for that date as values
+    """
+    return {date: data_frame.iloc[start:stop] for date, (start, stop) in get_daily_bounds(data_frame).items()}
+
 def get_data_for_date(data_frame, date):
-    """Summary: This function filters the data frame to only include data from a specific date
+    """Summary: This function filters the data frame to only include data from a specific date.
+                The data frame must be sorted by 'Date time' (see check_data).
 
     Args:
         data_frame (pandas.DataFrame): The data frame to filter
@@ -194,8 +295,9 @@ def get_data_for_date(data_frame, date):
     Returns:
         pandas.DataFrame: The data frame with only data from the specified date
     """
-    # filter the data frame to only include data from that date
-    day_data_frame = data_frame[data_frame['Date time'].dt.date == date]
+    # slice the data frame between midnight of that date and midnight of the next date
+    startTime = datetime.combine(date, datetime.min.time())
+    day_data_frame = get_time_slice(data_frame, startTime, startTime + timedelta(days=1), inclusive="left")
     return day_data_frame
 
 def get_time_at_desk(data_frame):
@@ -257,29 +359,33 @@ def compute_sitting_and_standing(data_frame):
     return data_frame
 
 def get_sitting_and_standing_percentage(data_frame):
-    """Summary: This function computes the percentage of time the person is sitting and standing for each day
+    """Summary: This function computes the percentage of time the person is sitting and standing for each day.
+    Each row counts for the time until the next row (see get_sample_durations), so the extra rows written at the changes
+    of presence between two samples do not count as samples.
     
     Args:
-        data_frame (pandas.DataFrame): The data frame to compute the sitting and standing percentage from
+        data_frame (pandas.DataFrame): The data frame sorted by 'Date time' to compute the sitting and standing percentage from
         
     Returns:
         dict: A dictionary with dates as keys and tuples of sitting and standing percentages as values
     """
-    data_frame = data_frame[data_frame['Human Present'] == True].copy()
+    # the durations are computed before the absent rows are removed, an absence ends the time of the row before it
+    data_frame = data_frame.assign(Duration=get_sample_durations(data_frame))
+    data_frame = data_frame[data_frame['Human Present'] == True]
     if data_frame.empty:
         return {}
 
-    standing_time = data_frame.groupby([data_frame['Date time'].dt.date, 'Standing']).size()
+    standing_time = data_frame.groupby([data_frame['Date time'].dt.date, 'Standing'])['Duration'].sum()
     # unstack the multi-index series to get a dataframe with dates as index and 'Standing' as columns
     standing_time = standing_time.unstack()
-    # check if both columns exist in case there person is always sitting or always standing
-    if len(standing_time.columns) < 2:
-        # add 'Sitting' column with all zeros if it doesn't exist
-        standing_time[False] = 0
+    # add the missing column with zeros in case the person is always sitting or always standing
+    standing_time = standing_time.reindex(columns=[False, True], fill_value=0)
     # rename the columns
     standing_time.columns = ['Sitting', 'Standing']
     # fill NaN values with 0
     standing_time = standing_time.fillna(0)
+    # a day whose present rows are all followed by a gap has no time to share
+    standing_time = standing_time[standing_time['Sitting'] + standing_time['Standing'] > 0]
     # convert to percentage
     standing_time['Total'] = standing_time['Sitting'] + standing_time['Standing']
     standing_time['Sitting'] = standing_time['Sitting'] / standing_time['Total']
@@ -370,6 +476,7 @@ def remove_outliers(data_frame, outlierThreshold = 3):
     Returns:
         pandas.DataFrame: The data frame with outliers removed
     """
+    from scipy.stats import zscore
     # remove outliers from the data frame
     data_frame = data_frame[np.abs(zscore(data_frame['Distance(mm)'])) < outlierThreshold]
     return data_frame
@@ -395,9 +502,24 @@ def remove_outliers_irq(data_frame, outlierThreshold = 1.5):
     data_frame = data_frame[(data_frame['Distance(mm)'] > (Q1 - outlierThreshold * IQR)) & (data_frame['Distance(mm)'] < (Q3 + outlierThreshold * IQR))]
     return data_frame
 
+def get_day_codes(data_frame):
+    """Summary: This function computes an integer day key for each row so that daily statistics can be computed with np.bincount
+
+    Args:
+        data_frame (pandas.DataFrame): The data frame to compute the day keys from
+
+    Returns:
+        numpy.ndarray: The number of days between the first date of the data frame and the date of each row
+    """
+    days = data_frame['Date time'].to_numpy().astype('datetime64[D]').astype(np.int64)
+    if len(days) == 0:
+        return days
+    return days - days.min()
+
 def remove_daily_outliers(data_frame, outlierThreshold = 3):
     """Summary: This function removes outliers from the data frame for each date. 
                 Outliers are defined as values that are outlierThreshold standard deviations away from the mean.
+                The daily mean and standard deviation are computed for all days at once so the filter is a single mask over the data frame.
 
     Args:
         data_frame (pandas.DataFrame): The data frame to remove outliers from
@@ -406,9 +528,43 @@ def remove_daily_outliers(data_frame, outlierThreshold = 3):
     Returns:
         pandas.DataFrame: The data frame with outliers removed
     """
-    # group data by date and remove outliers from each group
-    # data_frame = data_frame.groupby(data_frame['Date time'].dt.date).apply(remove_outliers_irq, outlierThreshold)
-    data_frame = data_frame.groupby(data_frame['Date time'].dt.date).apply(remove_outliers, outlierThreshold)
+    dayCodes = get_day_codes(data_frame)
+    distance = data_frame['Distance(mm)'].to_numpy(dtype=float)
+    # daily mean and population standard deviation (same as scipy.stats.zscore) using two passes of bincount
+    counts = np.bincount(dayCodes)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.bincount(dayCodes, weights=distance) / counts
+        deviation = distance - mean[dayCodes]
+        std = np.sqrt(np.bincount(dayCodes, weights=deviation**2) / counts)
+        # a day with constant distance has a nan zscore and is removed, like scipy.stats.zscore would
+        mask = np.abs(deviation / std[dayCodes]) < outlierThreshold
+    data_frame = data_frame[mask]
+    # reset index
+    data_frame = data_frame.reset_index(drop=True)
+    return data_frame
+
+def remove_daily_outliers_irq(data_frame, outlierThreshold = 1.5):
+    """Summary: This function removes outliers from the data frame for each date using the interquartile range of that date.
+                Outliers are defined as values that are outside of the range (Q1 - 1.5 * IQR, Q3 + 1.5 * IQR)
+
+    Args:
+        data_frame (pandas.DataFrame): The data frame to remove outliers from
+        outlierThreshold (float, optional): The number of interquartile ranges to consider as an outlier. Defaults to 1.5.
+
+    Returns:
+        pandas.DataFrame: The data frame with outliers removed
+    """
+    dayCodes = get_day_codes(data_frame)
+    distance = data_frame['Distance(mm)']
+    # compute the first and third quartiles of every day and broadcast them back to the rows
+    grouped = distance.groupby(dayCodes)
+    Q1 = grouped.transform('quantile', 0.25).to_numpy()
+    Q3 = grouped.transform('quantile', 0.75).to_numpy()
+    # compute the interquartile range
+    IQR = Q3 - Q1
+    distance = distance.to_numpy()
+    mask = (distance > (Q1 - outlierThreshold * IQR)) & (distance < (Q3 + outlierThreshold * IQR))
+    data_frame = data_frame[mask]
     # reset index
     data_frame = data_frame.reset_index(drop=True)
     return data_frame
@@ -473,45 +629,124 @@ def compute_daily_sit_stand_transitions(data_frame):
     copied_dt.loc[copied_dt.index[0], 'TransitionToDown'] = False
     return copied_dt.reset_index(drop=True)
 
-def compute_daily_threshold(data_frame, minDistance = 200):
-    """Summary: This function computes the daily threshold for each date in the data frame
+def compute_daily_threshold(data_frame, minDistance = 200, method = "otsu"):
+    """Summary: This function computes the daily threshold for each date in the data frame.
+                One distance histogram is built per date in a single np.bincount pass and the thresholds of all dates are derived from it at once.
 
     Args:
         data_frame (pandas.DataFrame): The data frame to compute the daily threshold from
         minDistance (int, optional): The minimum distance between the maximum and minimum values for the threshold. Defaults to 200.
+        method (str, optional): "otsu" for the split maximising the between class variance, "valley" for the lowest point between the two main modes
+                                or "mean" for the mean distance of the date. Defaults to "otsu".
 
     Returns:
         pandas.DataFrame: The data frame with the 'Threshold' column added
     """
-    # get the daily threshold for each date and create a new column 'Threshold' that is the threshold for that date
-    daily_threshold = data_frame.groupby(data_frame['Date time'].dt.date)['Distance(mm)'].apply(compute_threshold, minDistance)
+    if data_frame.empty:
+        data_frame['Threshold'] = pd.Series(dtype=float)
+        return data_frame
+    dayCodes, histograms, lowest, binWidth = compute_daily_histograms(data_frame)
+    if method == "otsu":
+        thresholdBins = compute_otsu_thresholds(histograms)
+        # values in bins up to the threshold bin are sitting, the threshold sits between the last sitting bin and the first standing bin
+        daily_threshold = lowest + (thresholdBins + 1) * binWidth - 0.5
+    elif method == "valley":
+        thresholdBins = compute_valley_thresholds(histograms, max(1, int(round(minDistance / 2 / binWidth))))
+        daily_threshold = lowest + (thresholdBins + 1) * binWidth - 0.5
+    elif method == "mean":
+        distance = data_frame['Distance(mm)'].to_numpy(dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            daily_threshold = np.bincount(dayCodes, weights=distance) / histograms.sum(axis=1)
+    else:
+        raise ValueError(f"Unknown threshold method: {method}")
+    # flag the dates where the distance does not vary enough to tell sitting from standing
+    grouped = data_frame['Distance(mm)'].groupby(dayCodes)
+    distanceRange = (grouped.max() - grouped.min()).reindex(range(len(histograms)), fill_value=0).to_numpy()
+    daily_threshold = np.where(distanceRange < minDistance, -1, daily_threshold)
     # add the threshold to the data frame
-    data_frame['Threshold'] = data_frame['Date time'].dt.date.map(daily_threshold)
+    data_frame['Threshold'] = daily_threshold[dayCodes]
     return data_frame
 
-def compute_threshold(Vector, minDistance = 0):
-    """Summary: This function computes the threshold for a vector of values
+def compute_daily_histograms(data_frame, maxBins = 4096):
+    """Summary: This function computes one histogram of the distance per date in a single pass.
+                Distances are rounded to the millimetre, the bins are widened if the distance range would need more than maxBins bins.
 
     Args:
-        Vector (list): The vector of values to compute the threshold from
-        minDistance (int, optional): The minimum distance between the maximum and minimum values for the threshold. Defaults to 0.
+        data_frame (pandas.DataFrame): The data frame to compute the histograms from
+        maxBins (int, optional): The maximum number of bins of each histogram. Defaults to 4096.
 
     Returns:
-        int: The threshold for the vector of values
+        tuple: The day key of each row, the histograms as a (days, bins) array, the distance of the first bin and the width of the bins in mm
     """
-    # convert to numpy array  
-    Vector = np.array(Vector)
-    # # remove outliers
-    # zscores = zscore(Vector)
-    
-    # Vector = Vector[abs(zscores) < outlierThreshold]
-    if len(Vector) == 0 or Vector.max() - Vector.min() < minDistance:
-        return -1
-    # compute the threshold
-    threshold = (Vector.max() + Vector.min())/1.2
-    threshold = Vector.mean() #+ Vector.std()
-    return threshold
-    
+    dayCodes = get_day_codes(data_frame)
+    distance = np.rint(data_frame['Distance(mm)'].to_numpy(dtype=float)).astype(np.int64)
+    lowest = int(distance.min())
+    binWidth = max(1, int(np.ceil((distance.max() - lowest + 1) / maxBins)))
+    bins = (distance - lowest) // binWidth
+    nBins = int(bins.max()) + 1
+    nDays = int(dayCodes.max()) + 1
+    # flatten (day, bin) into a single key so that all the histograms come out of one bincount
+    histograms = np.bincount(dayCodes * nBins + bins, minlength=nDays * nBins).reshape(nDays, nBins)
+    return dayCodes, histograms, lowest, binWidth
+
+def compute_otsu_thresholds(histograms):
+    """Summary: This function computes the Otsu threshold of each histogram, the bin that maximises the variance between the two classes it splits
+
+    Args:
+        histograms (numpy.ndarray): The histograms as a (days, bins) array
+
+    Returns:
+        numpy.ndarray: The index of the last bin of the lower class for each histogram
+    """
+    counts = histograms.astype(float)
+    levels = np.arange(counts.shape[1])
+    total = counts.sum(axis=1, keepdims=True)
+    # cumulative weight and first moment of the lower class for every possible split
+    weight = np.cumsum(counts, axis=1)
+    moment = np.cumsum(counts * levels, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        betweenVariance = (moment[:, -1:] * weight - moment * total) ** 2 / (weight * (total - weight))
+    betweenVariance = np.nan_to_num(betweenVariance, nan=-1, posinf=-1)
+    return get_plateau_centre(betweenVariance == betweenVariance.max(axis=1, keepdims=True))
+
+def compute_valley_thresholds(histograms, minSeparation, smoothing = 5):
+    """Summary: This function computes the lowest point of each histogram between its two main modes
+
+    Args:
+        histograms (numpy.ndarray): The histograms as a (days, bins) array
+        minSeparation (int): The minimum number of bins between the two modes
+        smoothing (int, optional): The number of bins of the moving average applied before looking for the modes. Defaults to 5.
+
+    Returns:
+        numpy.ndarray: The index of the valley bin for each histogram
+    """
+    # moving average along the bins using a cumulative sum
+    cumulative = np.cumsum(np.pad(histograms.astype(float), ((0, 0), (smoothing, 0))), axis=1)
+    smoothed = (cumulative[:, smoothing:] - cumulative[:, :-smoothing]) / smoothing
+    levels = np.arange(smoothed.shape[1])
+    # the highest mode, then the highest mode far enough from it
+    firstMode = np.argmax(smoothed, axis=1)
+    farEnough = np.abs(levels - firstMode[:, None]) >= minSeparation
+    secondMode = np.argmax(np.where(farEnough, smoothed, -1), axis=1)
+    lower = np.minimum(firstMode, secondMode)
+    upper = np.maximum(firstMode, secondMode)
+    between = (levels >= lower[:, None]) & (levels <= upper[:, None])
+    valley = np.where(between, smoothed, np.inf)
+    return get_plateau_centre(valley == valley.min(axis=1, keepdims=True))
+
+def get_plateau_centre(isBest):
+    """Summary: This function computes the middle of the best bins of each row, so that an empty gap between sitting and standing is split in its centre
+
+    Args:
+        isBest (numpy.ndarray): A (days, bins) boolean array that is True for the bins reaching the best value of the row
+
+    Returns:
+        numpy.ndarray: The index halfway between the first and last best bin of each row
+    """
+    first = np.argmax(isBest, axis=1)
+    last = isBest.shape[1] - 1 - np.argmax(isBest[:, ::-1], axis=1)
+    return (first + last) // 2
+
 def compute_present_to_absent_transitions(data_frame):
     """Summary: This function computes the present to absent and absent to present transitions in the data frame
 
@@ -560,6 +795,60 @@ def compute_present_to_absent(data_frame):
     
     return data_frame.reset_index(drop=True)
 
+def compute_transitions(data_frame):
+    """Summary: This function adds the sit to stand and presence transition columns, both computed date by date
+
+    Args:
+        data_frame (pandas.DataFrame): The data frame with the 'Standing' column
+
+    Returns:
+        pandas.DataFrame: The data frame with the transition columns added
+    """
+    data_frame = compute_sit_stand_transitions(data_frame)
+    return compute_present_to_absent_transitions(data_frame)
+
+def get_day_shards(data_frame, numShards):
+    """Summary: This function splits the data frame into contiguous shards of whole dates with about the same number of dates.
+                The data frame must be sorted by 'Date time' (see check_data).
+
+    Args:
+        data_frame (pandas.DataFrame): The data frame sorted by 'Date time'
+        numShards (int): The maximum number of shards
+
+    Returns:
+        list: The data frame slices, in time order
+    """
+    bounds = list(get_daily_bounds(data_frame).values())
+    shards = []
+    for days in np.array_split(np.arange(len(bounds)), max(1, numShards)):
+        if len(days) > 0:
+            shards.append(data_frame.iloc[bounds[days[0]][0]:bounds[days[-1]][1]])
+    return shards
+
+def compute_transitions_sharded(data_frame, workers = 1, shardsPerWorker = 4):
+    """Summary: This function computes the transition columns like compute_transitions, with the dates shared between worker processes.
+                Every date is handled on its own in compute_transitions, including the presence transitions forced on the first and last
+                row of each date, so merging the shards gives the same columns as a single pass. The transitions are paired and filtered
+                across midnight afterwards, on the merged data frame (see filter_transitions and get_present_to_absent_transitions).
+
+    Args:
+        data_frame (pandas.DataFrame): The data frame sorted by 'Date time' with the 'Standing' column
+        workers (int, optional): The number of worker processes, 1 to compute in this process. Defaults to 1.
+        shardsPerWorker (int, optional): The number of shards per worker, more shards balance the load better. Defaults to 4.
+
+    Returns:
+        pandas.DataFrame: The data frame with the transition columns added
+    """
+    if workers <= 1 or data_frame.empty:
+        return compute_transitions(data_frame)
+    shards = get_day_shards(data_frame, workers * shardsPerWorker)
+    if len(shards) == 1:
+        return compute_transitions(data_frame)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        # map keeps the shards in time order
+        results = list(executor.map(compute_transitions, shards))
+    return pd.concat(results, ignore_index=True)
+
 def compute_bouts(transition, presenceTransition):
     """Summary: This function computes the bouts of sitting and standing for each day
 
@@ -671,6 +960,34 @@ def SummaryExport(output_dir, name, dailyTransitions, percStanding, workDays, bo
     Returns:
         None
     """
+    summaryData = get_summary_data(dailyTransitions, percStanding, workDays, bouts)
+    write_summary(output_dir, name, summaryData)
+
+def write_summary(output_dir, name, summaryData):
+    """Summary: This function writes the summary data of a session to summary_<name>.csv
+
+    Args:
+        output_dir (str): The directory to save the csv file to
+        name (str): The name of the session
+        summaryData (pandas.DataFrame): The summary data returned by get_summary_data
+    Returns:
+        str: The path of the file written
+    """
+    outputPath = os.path.join(output_dir, f"summary_{name}.csv")
+    summaryData.to_csv(outputPath, index=False)
+    return outputPath
+
+def get_summary_data(dailyTransitions, percStanding, workDays, bouts):
+    """Summary: This function computes the summary data, one row per date
+
+    Args:
+        dailyTransitions (dict): A dictionary with dates as keys and the number of transitions as values
+        percStanding (dict): A dictionary with dates as keys and a tuple of the percentage of time spent sitting and standing as values
+        workDays (dict): A dictionary with dates as keys and tuples of start and end times as values
+        bouts (dict): A dictionary with dates as keys and a dictionary of bouts with keys 'Sitting' and 'Standing' as values
+    Returns:
+        pandas.DataFrame: The summary data with a 'Date' column
+    """
     summaryData =  pd.DataFrame()   
     # create the columns of the summary data and fill with NaN
     summaryData['Transitions'] = np.nan
@@ -756,13 +1073,119 @@ def SummaryExport(output_dir, name, dailyTransitions, percStanding, workDays, bo
     summaryData = summaryData.reset_index()
     # rename the columns
     summaryData = summaryData.rename(columns={'index': 'Date'})
+    return summaryData
     
-    
-    # #write summary data to csv
-    outputPath = os.path.join(output_dir, f"summary_{name}.csv")
-    summaryData.to_csv(outputPath, index=False)
-    #print(f"Summary data saved to {outputPath}")
-    
+# bout duration buckets of the cohort summary in minutes, the edges include the 30 min sitting and 40 min standing limits of the daily summary
+BOUT_BUCKETS = [0, 10, 20, 30, 40, 60]
+
+def get_sample_durations(data_frame):
+    """Summary: This function computes the time covered by each sample, from the sample to the next one. Samples followed by a gap of 2 median
+    sampling periods or more (a recording gap, the night or the end of the data) cover no time.
+
+    Args:
+        data_frame (pandas.DataFrame): The data frame sorted by 'Date time'
+
+    Returns:
+        numpy.ndarray: The duration of each sample in seconds
+    """
+    times = data_frame['Date time'].to_numpy()
+    durations = np.append(np.diff(times).astype('timedelta64[ns]').astype(np.int64) / 1e9, 0.0)
+    if len(durations) > 1:
+        median = np.median(durations[:-1])
+        durations[durations >= 2 * median] = 0.0
+    return durations
+
+def get_bout_bucket_labels():
+    """Summary: This function gives the labels of the bout duration buckets
+
+    Returns:
+        list: The labels, e.g. '0-10min' and '60min+'
+    """
+    labels = [f"{low}-{high}min" for low, high in zip(BOUT_BUCKETS[:-1], BOUT_BUCKETS[1:])]
+    return labels + [f"{BOUT_BUCKETS[-1]}min+"]
+
+def compute_hourly_summary(data_frame, transition, bouts):
+    """Summary: This function aggregates the results of a session per hour: time present, standing and sitting, transitions and
+    the number of bouts in each duration bucket. Transitions and bouts are counted in the hour they start.
+
+    Args:
+        data_frame (pandas.DataFrame): The data frame with the 'Human Present' and 'Standing' columns
+        transition (dict): A dictionary of filtered transitions with keys 'TransitionToUP' and 'TransitionToDown' that contain lists of datetime objects
+        bouts (dict): A dictionary of bouts with keys 'Sitting' and 'Standing' that contain lists of tuples of start and end times
+
+    Returns:
+        pandas.DataFrame: One row per hour with data, with the columns 'Date', 'Hour', the times in seconds and the counts
+    """
+    durations = get_sample_durations(data_frame)
+    present = data_frame['Human Present'].to_numpy(dtype=bool)
+    standing = data_frame['Standing'].to_numpy(dtype=bool)
+    hours = data_frame['Date time'].dt.floor('h').to_numpy()
+    hourly = pd.DataFrame({
+        'Presence time (s)': durations * present,
+        'Standing time (s)': durations * (present & standing),
+        'Sitting time (s)': durations * (present & ~standing),
+    }).groupby(hours).sum()
+
+    # count the transitions in the hour they happen
+    for name, column in [("TransitionToUP", 'Sit to stand transitions'), ("TransitionToDown", 'Stand to sit transitions')]:
+        transitionHours = pd.Series(pd.to_datetime(transition[name]), dtype='datetime64[ns]').dt.floor('h')
+        hourly = hourly.join(transitionHours.value_counts().rename(column), how='outer')
+
+    # count the bouts in the hour they start, per duration bucket
+    labels = get_bout_bucket_labels()
+    for boutType in ["Sitting", "Standing"]:
+        columns = [f"{boutType} bouts {label}" for label in labels]
+        boutList = bouts.get(boutType, [])
+        if len(boutList) == 0:
+            hourly[columns] = 0
+            continue
+        starts = pd.to_datetime([start for start, end in boutList])
+        minutes = (pd.to_datetime([end for start, end in boutList]) - starts).total_seconds().to_numpy() / 60
+        buckets = np.digitize(minutes, BOUT_BUCKETS[1:])
+        counts = pd.crosstab(starts.floor('h'), buckets).reindex(columns=range(len(labels)), fill_value=0)
+        counts.columns = columns
+        hourly = hourly.join(counts, how='outer')
+
+    hourly = hourly.fillna(0)
+    countColumns = [column for column in hourly.columns if not column.endswith("(s)")]
+    hourly[countColumns] = hourly[countColumns].astype(np.int32)
+    hourly.index = pd.DatetimeIndex(hourly.index)
+    hourly.insert(0, 'Date', hourly.index.date)
+    hourly.insert(1, 'Hour', hourly.index.hour.astype(np.int8))
+    return hourly.reset_index(drop=True)
+
+def CohortExport(output_dir, hourlySummaries):
+    """Summary: This function writes the hourly summaries of all the sessions to one typed parquet table, cohort_summary.parquet
+
+    Args:
+        output_dir (str): The directory to save the parquet file to
+        hourlySummaries (list): The data frames returned by compute_hourly_summary with the 'Participant' and 'Device' columns added
+
+    Returns:
+        str: The path of the file written, None if there is no summary
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    hourlySummaries = [summary for summary in hourlySummaries if summary is not None and not summary.empty]
+    if len(hourlySummaries) == 0:
+        return None
+    cohort = pd.concat(hourlySummaries, ignore_index=True)
+    cohort = cohort.sort_values(['Participant', 'Device', 'Date', 'Hour'], kind='stable').reset_index(drop=True)
+    fields = [
+        pa.field('Participant', pa.dictionary(pa.int32(), pa.string())),
+        pa.field('Device', pa.dictionary(pa.int32(), pa.string())),
+        pa.field('Date', pa.date32()),
+        pa.field('Hour', pa.int8()),
+    ]
+    for column in cohort.columns[len(fields):]:
+        fields.append(pa.field(column, pa.float64() if column.endswith("(s)") else pa.int32()))
+    cohort['Participant'] = cohort['Participant'].astype('category')
+    cohort['Device'] = cohort['Device'].astype('category')
+    table = pa.Table.from_pandas(cohort, schema=pa.schema(fields), preserve_index=False)
+    outputPath = os.path.join(output_dir, "cohort_summary.parquet")
+    pq.write_table(table, outputPath)
+    return outputPath
+
 def get_bouts(data_frame):
     """Summary: This function computes the bouts of sitting and standing for each day
     
@@ -0,0 +1,54 @@
+"""
+Fixtures for the analysis benchmarks. The synthetic data of each scale is generated once per test session and converted to parquet,
+and every stage of pipeline.Session runs once so that each stage can be timed on its real input.
+"""
+
+import os
+import sys
+import pytest
+
+# the analysis scripts are not a package, make them importable from the benchmarks folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import convert
+import pipeline
+import synthetic_data
+
+# participants and days of each scale, 1x is a single participant over a working week
+SCALES = {
+    1: dict(participants=1, days=5),
+    10: dict(participants=2, days=25),
+    100: dict(participants=10, days=50),
+}
+# comma separated list of the scales to run, e.g. STANDUP_BENCHMARK_SCALES=1,10
+ENABLED_SCALES = [int(scale) for scale in os.environ.get("STANDUP_BENCHMARK_SCALES", "1,10,100").split(",")]
+
+
+def pytest_generate_tests(metafunc):
+    if "scale" in metafunc.fixturenames:
+        metafunc.parametrize("scale", [scale for scale in SCALES if scale in ENABLED_SCALES], ids=lambda scale: f"{scale}x", scope="session")
+
+
+@pytest.fixture(scope="session")
+def raw_data(tmp_path_factory, scale):
+    """Synthetic device files of a scale, returns the root folder and the files of each session"""
+    root = str(tmp_path_factory.mktemp(f"raw_{scale}x"))
+    sessions = synthetic_data.generate_dataset(root, **SCALES[scale])
+    return root, sessions
+
+
+@pytest.fixture(scope="session")
+def converted_data(tmp_path_factory, raw_data, scale):
+    """The synthetic data converted to one parquet file per session, returns the parquet file of the longest session"""
+    root, sessions = raw_data
+    outdir = str(tmp_path_factory.mktemp(f"converted_{scale}x"))
+    convert.batch_process_files(root, outdir)
+    session = max(sessions, key=lambda session: len(sessions[session]))
+    return os.path.join(outdir, f"{session}.parquet")
+
+
+@pytest.fixture(scope="session")
+def analysed_session(converted_data):
+    """The pipeline.Session of the longest session, with the settings main.py uses. Its stages run once and keep their results,
+    so that each stage can be timed on the results of the stages it depends on"""
+    return pipeline.Session(converted_data)
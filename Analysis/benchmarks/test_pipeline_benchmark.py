@@ -0,0 +1,48 @@
+"""
+Benchmarks of the analysis pipeline on synthetic data at 1x, 10x and 100x scale.
+
+Run from the Analysis folder with:
+    python -m pytest benchmarks --benchmark-group-by=func
+Compare two runs with --benchmark-autosave and pytest-benchmark compare.
+"""
+
+import os
+import pytest
+import convert
+import main
+import pipeline
+
+# the stages of pipeline.py timed one by one, the figures are only timed in the end to end benchmark
+BENCHMARKED_STAGES = [name for name in pipeline.STAGES if name not in pipeline.FIGURES.values()]
+
+ROUNDS = 3
+# the conversion and the end to end run take minutes at the larger scales
+SLOW_ROUNDS = 1
+
+
+def run_stage(benchmark, function, *args, **kwargs):
+    return benchmark.pedantic(function, args=args, kwargs=kwargs, rounds=ROUNDS, iterations=1)
+
+
+def test_convert_session(benchmark, raw_data, tmp_path):
+    root, sessions = raw_data
+    session = max(sessions, key=lambda session: len(sessions[session]))
+    benchmark.pedantic(convert.process_session, args=(session, sessions[session], str(tmp_path)), rounds=SLOW_ROUNDS, iterations=1)
+
+
+@pytest.mark.parametrize("stage", BENCHMARKED_STAGES)
+def test_stage(benchmark, analysed_session, stage):
+    # the stage function of pipeline.py called on the results of its dependencies, as Session.get calls it
+    function, dependencies = pipeline.STAGES[stage]
+    inputs = [analysed_session.get(dependency) for dependency in dependencies]
+    run_stage(benchmark, function, analysed_session, *inputs)
+
+
+def test_end_to_end(benchmark, raw_data, tmp_path):
+    root, sessions = raw_data
+    def convert_analyse_export():
+        outdir = str(tmp_path)
+        convert.batch_process_files(root, outdir)
+        for session in sessions:
+            main.process_file(os.path.join(outdir, f"{session}.parquet"), outdir)
+    benchmark.pedantic(convert_analyse_export, rounds=SLOW_ROUNDS, iterations=1)
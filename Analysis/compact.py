@@ -0,0 +1,152 @@
+"""
+This script compacts the parquet files written by convert.py. Each session file is rewritten in time order, with a single row per timestamp
+and row groups of a target number of rows, so that readers scan few large row groups and can skip the ones outside a time range
+using the 'Date time' statistics. A file that is already sorted, unique and made of full row groups is left untouched.
+
+The compacted file is written next to the original under a name that does not end in .parquet, flushed to disk and then swapped in with
+os.replace, so a loader sees either the old or the new file and never a partially compacted one.
+
+Usage:
+    python compact.py <converted folder> [--row-group-size 131072] [--force] [--dry-run]
+"""
+
+import os
+import argparse
+import pandas as pd
+import convert
+# pyarrow is imported in the functions that use it
+
+# the row group size convert.py writes the session files with
+TARGET_ROW_GROUP_SIZE = convert.ROW_GROUP_SIZE
+
+
+def get_session_files(store):
+    """Summary: Get the session parquet files of a folder and its subfolders, the other parquet files (e.g. cohort_summary.parquet) are left out
+
+    Args:
+        store (str): The folder written by convert.py
+
+    Returns:
+        list: The paths of the session files, sorted
+    """
+    import pyarrow.parquet as pq
+    paths = sorted(os.path.join(path, name) for path, subdirs, files in os.walk(store) for name in files if name.endswith(".parquet"))
+    return [path for path in paths if 'Date time' in pq.read_schema(path).names]
+
+def needs_compaction(path, row_group_size=TARGET_ROW_GROUP_SIZE):
+    """Summary: Check whether a parquet file needs compacting: row groups smaller than the target (other than the last one),
+                or timestamps that are not strictly increasing. Only the footer and the 'Date time' column are read.
+
+    Args:
+        path (str): The path to the parquet file
+        row_group_size (int, optional): The target number of rows per row group. Defaults to TARGET_ROW_GROUP_SIZE.
+
+    Returns:
+        bool: True if the file should be compacted
+    """
+    import pyarrow.parquet as pq
+    parquetFile = pq.ParquetFile(path)
+    metadata = parquetFile.metadata
+    rowGroupRows = [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)]
+    # a row group may hold less than the target only if it is the last one, and never more
+    if any(rows < row_group_size for rows in rowGroupRows[:-1]) or any(rows > row_group_size for rows in rowGroupRows):
+        return True
+    times = parquetFile.read(columns=['Date time']).column('Date time').to_pandas()
+    return not (times.is_monotonic_increasing and times.is_unique)
+
+def write_atomically(table, path, row_group_size=TARGET_ROW_GROUP_SIZE):
+    """Summary: Write a table to a parquet file through a temporary file swapped in with os.replace
+
+    Args:
+        table (pyarrow.Table): The table to write
+        path (str): The path to the parquet file
+        row_group_size (int, optional): The number of rows per row group. Defaults to TARGET_ROW_GROUP_SIZE.
+    """
+    import pyarrow.parquet as pq
+    folder, name = os.path.split(path)
+    # the temporary name does not end in .parquet so that the loaders walking the folder never pick it up
+    tempFile = os.path.join(folder, f".{name}.compacting")
+    try:
+        with open(tempFile, 'wb') as f:
+            pq.write_table(table, f, row_group_size=row_group_size)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tempFile, path)
+    finally:
+        if os.path.exists(tempFile):
+            os.remove(tempFile)
+    # make the rename itself durable where directories can be synced
+    if hasattr(os, "O_DIRECTORY"):
+        folderFd = os.open(folder or ".", os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(folderFd)
+        finally:
+            os.close(folderFd)
+
+def compact_file(path, row_group_size=TARGET_ROW_GROUP_SIZE):
+    """Summary: Rewrite a session file in time order, with a single row per timestamp and row groups of row_group_size rows
+
+    Args:
+        path (str): The path to the parquet file
+        row_group_size (int, optional): The number of rows per row group. Defaults to TARGET_ROW_GROUP_SIZE.
+
+    Returns:
+        dict: The number of rows and row groups before and after compacting
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    table = pq.read_table(path)
+    rowGroupsBefore = pq.ParquetFile(path).metadata.num_row_groups
+    data_frame = table.to_pandas()
+    if not data_frame['Date time'].is_monotonic_increasing:
+        data_frame = data_frame.sort_values('Date time', kind='stable', ignore_index=True)
+    numDuplicates = 0
+    if not data_frame['Date time'].is_unique or 'Conflict' not in data_frame.columns:
+        readingColumns = data_frame.columns.drop(['Date time', 'Device', 'Conflict'], errors='ignore')
+        data_frame, numDuplicates, _ = convert.remove_duplicate_timestamps(data_frame, readingColumns)
+    write_atomically(pa.Table.from_pandas(data_frame, preserve_index=False), path, row_group_size)
+    return {
+        "file": path,
+        "rows_before": table.num_rows,
+        "rows_after": len(data_frame),
+        "duplicates": numDuplicates,
+        "row_groups_before": rowGroupsBefore,
+        "row_groups_after": pq.ParquetFile(path).metadata.num_row_groups,
+    }
+
+def compact_store(store, row_group_size=TARGET_ROW_GROUP_SIZE, force=False, dry_run=False):
+    """Summary: Compact the parquet files of a folder that need it
+
+    Args:
+        store (str): The folder written by convert.py
+        row_group_size (int, optional): The number of rows per row group. Defaults to TARGET_ROW_GROUP_SIZE.
+        force (bool, optional): Whether to rewrite the files that are already compact. Defaults to False.
+        dry_run (bool, optional): Whether to only list the files that need compacting. Defaults to False.
+
+    Returns:
+        pandas.DataFrame: One row per file compacted (or to compact if dry_run is True)
+    """
+    results = []
+    for path in get_session_files(store):
+        if not force and not needs_compaction(path, row_group_size):
+            continue
+        if dry_run:
+            results.append({"file": path})
+            continue
+        results.append(compact_file(path, row_group_size))
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact the parquet files written by convert.py")
+    parser.add_argument("store", help="folder containing the converted parquet files")
+    parser.add_argument("--row-group-size", type=int, default=TARGET_ROW_GROUP_SIZE, help=f"rows per row group (default: {TARGET_ROW_GROUP_SIZE})")
+    parser.add_argument("--force", action="store_true", help="rewrite the files that are already compact")
+    parser.add_argument("--dry-run", action="store_true", help="only list the files that need compacting")
+    args = parser.parse_args()
+
+    results = compact_store(args.store, args.row_group_size, args.force, args.dry_run)
+    if results.empty:
+        print("Nothing to compact")
+    else:
+        print(results.to_string(index=False))
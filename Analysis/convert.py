@@ -1,38 +1,231 @@
 import os
+import gzip
+import argparse
 import pandas as pd
-import pyarrow as pa 
-import pyarrow.parquet as pq 
 from tqdm import tqdm
 from datetime import datetime, timedelta
 import numpy as np
-import tkinter as tk
-from tkinter import filedialog
 import concurrent.futures
+# pyarrow and tkinter are imported only when they are needed
 
+# rows per parquet row group, readers can skip the row groups outside of a time range (see compact.py)
+ROW_GROUP_SIZE = 128 * 1024
 
+# the extensions of the files recorded by the devices, CSV rows or binary records, gzipped by the devices with upload_compression = gzip
+SESSION_FILE_EXTENSIONS = (".csv", ".bin", ".csv.gz", ".bin.gz")
+BINARY_FILE_EXTENSIONS = (".bin", ".bin.gz")
+# binary format written by Firmware/data_writer.py, an 8 byte header followed by fixed width little endian records
+BINARY_MAGIC = b"SDSB"
+BINARY_HEADER_SIZE = 8
+BINARY_RECORD_DTYPES = {
+    1: np.dtype([('time', '<u4'), ('distance', '<u2'), ('flags', 'u1')]),
+    # runs of samples written with compression = deadband
+    2: np.dtype([('time', '<u4'), ('distance', '<u2'), ('flags', 'u1'), ('samples', '<u2')]),
+}
+MISSING_DISTANCE = 0xFFFF
+PRESENCE_FLAG = 0x01
+# the column holding the number of samples of a run in the files written with compression = deadband
+RUN_COLUMN = 'Samples'
+# the sampling period of the default device configuration, used for the files of runs too short to measure it
+DEFAULT_SAMPLING_PERIOD = 5
 
-def load_data_from_csv(path_list):
-    """Summary: Load data from a list of CSV files and merge them into a single DataFrame
+
+def read_binary_file(file_path):
+    """Summary: Read a binary file recorded by a device, gzipped or not. The records are decoded in place with np.frombuffer into the columns of the CSV files
+
+    Args:
+        file_path (str): The path to the binary file
+
+    Raises:
+        ValueError: If the file is not a binary file or its format version is not supported
+
+    Returns:
+        pandas.DataFrame: The data of the file with the 'Date time', 'Distance(mm)' and 'Human Present' columns, and the 'Samples' column for runs
+    """
+    with (gzip.open if file_path.endswith(".gz") else open)(file_path, 'rb') as f:
+        content = f.read()
+    magic, version, recordSize = content[:4], content[4], content[5]
+    if magic != BINARY_MAGIC:
+        raise ValueError(f"{file_path} is not a binary session file")
+    if version not in BINARY_RECORD_DTYPES or BINARY_RECORD_DTYPES[version].itemsize != recordSize:
+        raise ValueError(f"Unsupported binary format version {version} in {file_path}")
+    # a record cut by a power loss is left out
+    numRecords = (len(content) - BINARY_HEADER_SIZE) // recordSize
+    records = np.frombuffer(content, dtype=BINARY_RECORD_DTYPES[version], count=numRecords, offset=BINARY_HEADER_SIZE)
+    distance = records['distance']
+    missing = distance == MISSING_DISTANCE
+    # the RTC time is stored as seconds since 1970 without time zone, as the CSV timestamps
+    df = pd.DataFrame({
+        'Date time': pd.to_datetime(records['time'], unit='s'),
+        'Distance(mm)': np.where(missing, np.nan, distance) if missing.any() else distance.astype(np.int64),
+        'Human Present': (records['flags'] & PRESENCE_FLAG).astype(np.int64),
+    })
+    if 'samples' in records.dtype.names:
+        df[RUN_COLUMN] = records['samples'].astype(np.int64)
+    return df
+
+def expand_runs(data_frame):
+    """Summary: Expand the runs of a file written with compression = deadband back to one row per sample.
+                The sampling period is measured from the runs followed by another run, as the median time between their starts per sample.
+                The samples of a run are spread evenly up to the start of the next run, unless there is a recording gap between them
+                (more than twice the sampling period per sample, as in analysis.get_sample_durations), in which case they are spread at the sampling period.
+
+    Args:
+        data_frame (pandas.DataFrame): The runs in time order, with the 'Samples' column
+
+    Returns:
+        pandas.DataFrame: One row per sample, without the 'Samples' column
+    """
+    samples = data_frame[RUN_COLUMN].to_numpy()
+    starts = data_frame['Date time'].to_numpy()
+    # time from the start of each run to the start of the next one per sample, the last run has no next run
+    steps = np.diff(starts).astype('timedelta64[ns]').astype(np.float64) / samples[:-1]
+    period = np.median(steps) if len(steps) > 0 else DEFAULT_SAMPLING_PERIOD * 1e9
+    steps = np.append(steps, period)
+    # runs that end with a recording gap, and the last run, use the sampling period
+    steps = np.where(steps < 2 * period, steps, period)
+    rows = np.repeat(np.arange(len(data_frame)), samples)
+    # index of each sample in its run
+    offsets = np.arange(len(rows)) - np.repeat(np.cumsum(samples) - samples, samples)
+    expanded = data_frame.iloc[rows].drop(columns=RUN_COLUMN).reset_index(drop=True)
+    times = starts[rows] + (offsets * steps[rows]).astype('timedelta64[ns]')
+    expanded['Date time'] = pd.to_datetime(times).floor('s')
+    return expanded
+
+
+def read_session_file(file_path):
+    """Summary: Read a CSV or binary file recorded by a device, gzipped or not, with the 'Date time' column parsed and the rows sorted by time
+
+    Args:
+        file_path (str): The path to the CSV or binary file
+
+    Returns:
+        pandas.DataFrame: The data of the file, None if the file is empty or cannot be read
+    """
+    try:
+        if file_path.endswith(BINARY_FILE_EXTENSIONS):
+            df = read_binary_file(file_path)
+        else:
+            # pandas decompresses the .csv.gz files
+            df = pd.read_csv(file_path)
+            df['Date time'] = pd.to_datetime(df['Date time'], format='%Y-%m-%d %H:%M:%S')
+        if df.empty:
+            return None
+        if RUN_COLUMN in df.columns:
+            df = expand_runs(df.sort_values('Date time', kind='stable', ignore_index=True))
+    except Exception as e:
+        # print(f"Error reading file {file_path}: {e}")
+        return None
+    # the rows of a file are in time order unless the clock was set back while it was recorded
+    if not df['Date time'].is_monotonic_increasing:
+        df = df.sort_values('Date time', kind='stable', ignore_index=True)
+    return df
+
+def merge_sorted_frames(frames):
+    """Summary: Merge data frames that are each sorted by 'Date time' into a single sorted data frame.
+                The frames are taken in the order of their first timestamp. A frame that starts after the end of the merged data is appended as is,
+                only the rows that overlap are merged, so files that do not overlap, the usual case, cost a single concatenation.
+                Rows with the same timestamp keep the order of the frames they come from.
+
+    Args:
+        frames (list): The data frames sorted by 'Date time', with the same columns
+
+    Returns:
+        pandas.DataFrame: The merged data frame sorted by 'Date time'
+    """
+    frames = sorted((frame for frame in frames if frame is not None and not frame.empty), key=lambda frame: frame['Date time'].iloc[0])
+    if len(frames) == 0:
+        return pd.DataFrame()
+    chunks = []
+    tail = frames[0] # the end of the merged data, the part the next frames can still overlap
+    for frame in frames[1:]:
+        start = frame['Date time'].iloc[0]
+        if start > tail['Date time'].iloc[-1]:
+            chunks.append(tail)
+            tail = frame
+            continue
+        # the rows of the tail before the start of the frame are final, the rest is merged with the frame
+        split = tail['Date time'].searchsorted(start, side='left')
+        chunks.append(tail.iloc[:split])
+        tail = pd.concat([tail.iloc[split:], frame], ignore_index=True).sort_values('Date time', kind='stable')
+    chunks.append(tail)
+    return pd.concat(chunks, ignore_index=True)
+
+def remove_duplicate_timestamps(data_frame, columns=None):
+    """Summary: Keep a single row per timestamp of a data frame sorted by 'Date time'. Rows repeating the same reading are dropped.
+                When a timestamp has different readings (the same sample recorded twice with different values) the first one is kept
+                and the 'Conflict' column flags it. The flags of a data frame that already has a 'Conflict' column are kept.
+
+    Args:
+        data_frame (pandas.DataFrame): The data frame sorted by 'Date time'
+        columns (list, optional): The columns of the reading compared between rows. Defaults to all the columns but 'Date time' and 'Conflict'.
+
+    Returns:
+        tuple: The data frame with unique timestamps and the 'Conflict' column, the number of rows dropped and the number of conflicting timestamps
+    """
+    times = data_frame['Date time'].to_numpy()
+    # True for the rows with the same timestamp as the previous row
+    sameTime = np.zeros(len(times), dtype=bool)
+    sameTime[1:] = times[1:] == times[:-1]
+    sameReading = sameTime.copy()
+    if columns is None:
+        columns = data_frame.columns.drop(['Date time', 'Conflict'], errors='ignore')
+    for column in columns:
+        values = data_frame[column].to_numpy()
+        equal = values[1:] == values[:-1]
+        if values.dtype.kind == 'f':
+            equal |= np.isnan(values[1:]) & np.isnan(values[:-1])
+        sameReading[1:] &= equal
+    # flag the timestamps where any of the rows has a different reading
+    timestampIndex = np.cumsum(~sameTime) - 1
+    conflictRows = sameTime & ~sameReading
+    if 'Conflict' in data_frame.columns:
+        conflictRows |= data_frame['Conflict'].to_numpy(dtype=bool)
+    conflict = np.bincount(timestampIndex, weights=conflictRows, minlength=timestampIndex[-1] + 1 if len(times) else 0) > 0
+    data_frame = data_frame[~sameTime].reset_index(drop=True)
+    data_frame['Conflict'] = conflict
+    return data_frame, int(sameTime.sum()), int(conflict.sum())
+
+def get_device_id(file_path):
+    """Summary: Get the id of the device that recorded a file from its name, e.g. A30A for A30A_0000_231102_160737.csv
+
+    Args:
+        file_path (str): The path to the CSV file
+
+    Returns:
+        str: The device id
+    """
+    return os.path.basename(file_path).split("_")[0]
+
+def load_data_from_csv(path_list, device_column=False):
+    """Summary: Load data from a list of CSV or binary files and merge them into a single DataFrame sorted by time with a single row per timestamp.
+                The same samples can be in several files (temp files recovered at startup, files downloaded twice), the duplicates are dropped
+                and the timestamps recorded with different readings are flagged in the 'Conflict' column (see remove_duplicate_timestamps).
 
     Args:
         path_list (list): A list of file paths to the CSV files
+        device_column (bool, optional): Whether to add the categorical 'Device' column with the device that recorded each row, to merge the files
+                                        of several devices. Defaults to False.
 
     Returns:
         pandas.DataFrame: A merged DataFrame containing the data from all the CSV files
     """
-    # Loop through each CSV file and append its data to the merged DataFrame
-    merged_df = pd.DataFrame()
+    frames = []
     for file_path in tqdm(path_list, desc="Loading data", dynamic_ncols=True):
-        try:
-            df = pd.read_csv(file_path)
-            if df.empty:
-                continue
-            # check if the data frame is empty
-            # Append the data to the merged DataFrame
-            merged_df = pd.concat([merged_df, df], ignore_index=True)
-        except Exception as e:
-            # print(f"Error reading file {file_path}: {e}")
-            continue
+        df = read_session_file(file_path)
+        if df is not None and device_column:
+            df['Device'] = get_device_id(file_path)
+        frames.append(df)
+    # the files of all the devices go through the same k-way merge, a file only needs sorting against the files it overlaps
+    merged_df = merge_sorted_frames(frames)
+    if merged_df.empty:
+        return merged_df
+    readingColumns = merged_df.columns.drop(['Date time', 'Device', 'Conflict'], errors='ignore')
+    merged_df, numDuplicates, numConflicts = remove_duplicate_timestamps(merged_df, readingColumns)
+    if device_column:
+        merged_df['Device'] = merged_df['Device'].astype('category')
+    if numDuplicates > 0:
+        print(f"Dropped {numDuplicates} rows with a duplicate timestamp, {numConflicts} timestamps have conflicting readings")
     return merged_df
 
 def process_data(data_frame):
@@ -57,9 +250,11 @@ def write_to_parquet(data_frame, file_name):
         data_frame (pandas.DataFrame): The data frame to write
         file_name (str): The path to the output file
     """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
     # write the data frame to a parquet file
     table = pa.Table.from_pandas(data_frame)
-    pq.write_table(table, file_name)
+    pq.write_table(table, file_name, row_group_size=ROW_GROUP_SIZE)
     
 def write_to_csv(data_frame, file_name):
     """Summary: Write the data frame to a csv file
@@ -72,11 +267,13 @@ def write_to_csv(data_frame, file_name):
     data_frame.to_csv(file_name, index=False)
     
     
-def get_session_file_paths(fileList):
+def get_session_file_paths(fileList, merge_devices=False):
     """Summary: Get a dictionary with the session id as the key and a list of file paths as the value
 
     Args:
         fileList (list): A list of file paths
+        merge_devices (bool, optional): Whether to key the sessions by participant only, so that the files of all the devices of a participant
+                                        form one session. Defaults to False, the sessions are keyed by participant and device.
 
     Returns:
         dict: A dictionary with the session id as the key and a list of file paths as the value
@@ -90,7 +287,7 @@ def get_session_file_paths(fileList):
         # get the patient id from the file name
         patient_id = base_name.split("_")[1]
         device_id = base_name.split("_")[0]
-        session_id = f"{patient_id}_{device_id}"
+        session_id = patient_id if merge_devices else f"{patient_id}_{device_id}"
         if session_id not in session_files:
             session_files[session_id] = []
         session_files[session_id].append(file)
@@ -98,39 +295,46 @@ def get_session_file_paths(fileList):
     return session_files
 
     
-def process_session(session, fileList, outdir):
+def process_session(session, fileList, outdir, csv=True, merge_devices=False):
     """Summary: Process a session. Load the data from the list of files, process the data, and write it to a parquet file and a csv file
 
     Args:
         session (str): The session id
         fileList (list): A list of file paths
         outdir (str): The output directory
+        csv (bool, optional): Whether to also write the csv file. Defaults to True.
+        merge_devices (bool, optional): Whether the session has the files of several devices, recorded in the 'Device' column. Defaults to False.
         
     """
     # load the data from the list of files
-    merged_df = load_data_from_csv(fileList)
+    merged_df = load_data_from_csv(fileList, device_column=merge_devices)
     # process the data
     merged_df = process_data(merged_df)
     # write the data to a parquet file
     destination = os.path.join(outdir, f"{session}.parquet")
     write_to_parquet(merged_df, destination)
-    destination = os.path.join(outdir, f"{session}.csv")
-    write_to_csv(merged_df, destination)
+    if csv:
+        destination = os.path.join(outdir, f"{session}.csv")
+        write_to_csv(merged_df, destination)
     
 
-def batch_process_files(input_dir, output_dir):
-    """Summary: Batch process all the files in the input directory. Recursively get all the files in the directory that end with .csv, get a dictionary with the session id as the key and a list of file paths as the value, and process each session in parallel
+def batch_process_files(input_dir, output_dir, csv=True, workers=None, merge_devices=False):
+    """Summary: Batch process all the files in the input directory. Recursively get all the files in the directory recorded by the devices (SESSION_FILE_EXTENSIONS), get a dictionary with the session id as the key and a list of file paths as the value, and process each session in parallel
 
     Args:
         input_dir (str): The input directory
         output_dir (str): The output directory
+        csv (bool, optional): Whether to also write a csv file for each session. Defaults to True.
+        workers (int, optional): The number of sessions processed in parallel. Defaults to the ThreadPoolExecutor default.
+        merge_devices (bool, optional): Whether to write one session per participant with the data of all their devices. Defaults to False.
     """
-    # recursively get all the files in the directory that end with .csv
-    completeFileList = [os.path.join(path, name) for path, subdirs, files in os.walk(input_dir) for name in files if name.endswith(".csv")]
+    os.makedirs(output_dir, exist_ok=True)
+    # recursively get all the files in the directory recorded by the devices
+    completeFileList = [os.path.join(path, name) for path, subdirs, files in os.walk(input_dir) for name in files if name.endswith(SESSION_FILE_EXTENSIONS)]
     # get a dictionary with the session id as the key and a list of file paths as the value
-    session_files = get_session_file_paths(completeFileList) 
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = {executor.submit(process_session, session, fileList, output_dir): session for session, fileList in session_files.items()}
+    session_files = get_session_file_paths(completeFileList, merge_devices) 
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(process_session, session, fileList, output_dir, csv, merge_devices): session for session, fileList in session_files.items()}
         progress = tqdm(concurrent.futures.as_completed(futures), total=len(futures), desc="Processing sessions", dynamic_ncols=True)
         for future in progress:
             session = futures[future]
@@ -139,17 +343,40 @@ def batch_process_files(input_dir, output_dir):
             except Exception as e:
                 print(f"Error processing session {session}: {e}")
    
-if __name__ == "__main__":
+def parse_arguments():
+    """Summary: Parse the command line arguments
+
+    Returns:
+        argparse.Namespace: The parsed arguments
+    """
+    parser = argparse.ArgumentParser(description="Convert the csv files recorded by the devices to one parquet file per session. Folder pickers are shown for the folders that are not given.")
+    parser.add_argument("input_dir", nargs="?", help="folder containing the participant data")
+    parser.add_argument("output_dir", nargs="?", help="folder to save the converted files to")
+    parser.add_argument("--no-csv", action="store_true", help="only write the parquet files, not the merged csv files")
+    parser.add_argument("--workers", type=int, default=None, help="number of sessions converted in parallel")
+    parser.add_argument("--merge-devices", action="store_true",
+                        help="write one session per participant with the data of all their devices and a 'Device' column")
+    return parser.parse_args()
 
-    root = tk.Tk()
-    root.withdraw()
-    folder_selected = filedialog.askdirectory(title="Select the folder containing the participant data")
+if __name__ == "__main__":
+    args = parse_arguments()
+    folder_selected = args.input_dir
+    outdir = args.output_dir
+    if not folder_selected or not outdir:
+        # fall back to the folder pickers when the folders are not given on the command line
+        import tkinter as tk
+        from tkinter import filedialog
+        root = tk.Tk()
+        root.withdraw()
     if not folder_selected:
-        print("No folder selected. Exiting.")
-        exit()
-    outdir = filedialog.askdirectory(title="Select the output folder")
+        folder_selected = filedialog.askdirectory(title="Select the folder containing the participant data")
+        if not folder_selected:
+            print("No folder selected. Exiting.")
+            exit()
     if not outdir:
-        print("No output folder selected. Exiting.")
-        exit()
+        outdir = filedialog.askdirectory(title="Select the output folder")
+        if not outdir:
+            print("No output folder selected. Exiting.")
+            exit()
 
-    batch_process_files(folder_selected, outdir)
\ No newline at end of file
+    batch_process_files(folder_selected, outdir, csv=not args.no_csv, workers=args.workers, merge_devices=args.merge_devices)
\ No newline at end of file
@@ -10,88 +10,185 @@ Date: 27/03/2023
 """
 
 import os
+import argparse
+import concurrent.futures
 from datetime import datetime, timedelta
 import analysis
-from plotly import express as px
-from plotly import io as pio
-
-import plotting
+import pipeline
+import profiling
+import scheduling
 from tqdm import tqdm
-from tkinter import filedialog
-import tkinter as tk
+# plotly, plotting and tkinter are imported only when they are needed so that a summary only run starts quickly.
+# The stages of the analysis are declared in pipeline.py and only the ones needed for the requested outputs run.
 
 
-if __name__ == '__main__':
-    root = tk.Tk()
-    root.withdraw()
-    input_dir = filedialog.askdirectory(title="Select the folder containing the Standup data")
-    if not input_dir:
-        print("No folder selected. Exiting.")
-        exit()
-    # output_dir = "C:\\Users\\LocalSK\\Downloads\\DPS_Merged\\results"
-    output_dir = filedialog.askdirectory(title="Select the output folder")
-    if not output_dir:
-        print("No output folder selected. Exiting.")
-        exit()
+def process_file(file, output_dir, profiler=None, summary=True, plots=True, day_workers=1):
+    """Summary: Analyse a parquet file produced by convert.py and save its summary and figures in the output directory
+
+    Args:
+        file (str): The path to the parquet file
+        output_dir (str): The directory to save the summary csv and the html figures to
+        profiler (profiling.Profiler, optional): The profiler recording the cost of each stage. Defaults to a disabled profiler.
+        summary (bool, optional): Whether to export the summary csv. Defaults to True.
+        plots (bool, optional): Whether to plot and save the html figures. Defaults to True.
+        day_workers (int, optional): The number of worker processes sharing the dates of the session for the transitions. Defaults to 1.
+
+    Returns:
+        pandas.DataFrame: The hourly summary of the session for the cohort table, None if the summary is not computed
+    """
+    session = pipeline.Session(file, profiler=profiler, day_workers=day_workers)
+    file_base = session.name
+
+    print(f"Loading {file}")
+    hourlySummary = None
+    total_duration = session.duration
+    if total_duration > timedelta(hours=24):
+        print(f"Processing {file_base} with duration {total_duration}")
+        if summary:
+            print(f"Exporting summary for {file_base}")
+            analysis.write_summary(output_dir, file_base, session.summary)
+            hourlySummary = session.hourly_summary
+
+        if plots:
+            from plotly import io as pio
+            print(f"Plotting figures for {file_base}")
+            # each figure only runs the stages it needs that have not run yet
+            for name in tqdm(session.figures, desc="Saving figures", dynamic_ncols=True):
+                outFile = os.path.join(output_dir, f"{name}_{file_base}.html")
+                pio.write_html(session.figures[name], outFile)
+    session.profiler.write(output_dir)
+    return hourlySummary
+
+
+def run_file(file, output_dir, summary=True, plots=True, profile=False, day_workers=1):
+    """Summary: Analyse a parquet file with its own profiler, used as the task of the worker processes
+
+    Args:
+        file (str): The path to the parquet file
+        output_dir (str): The directory to save the results to
+        summary (bool, optional): Whether to export the summary csv. Defaults to True.
+        plots (bool, optional): Whether to plot and save the html figures. Defaults to True.
+        profile (bool, optional): Whether to record the cost of each stage. Defaults to False.
+        day_workers (int, optional): The number of worker processes sharing the dates of the session. Defaults to 1.
+
+    Returns:
+        tuple: The profiling records of the file, empty if profile is False, and its hourly summary
+    """
+    profiler = profiling.Profiler(os.path.splitext(os.path.basename(file))[0], enabled=profile)
+    hourlySummary = process_file(file, output_dir, profiler, summary=summary, plots=plots, day_workers=day_workers)
+    return profiler.records, hourlySummary
+
+def batch_process_files(input_dir, output_dir, summary=True, plots=True, profile=False, workers=1, day_workers=1, memory_budget=None):
+    """Summary: Analyse all the parquet files in the input directory, in parallel worker processes if workers is more than 1
+
+    Args:
+        input_dir (str): The directory containing the parquet files produced by convert.py
+        output_dir (str): The directory to save the results to
+        summary (bool, optional): Whether to export the summary csvs and the cohort_summary.parquet table. Defaults to True.
+        plots (bool, optional): Whether to plot and save the html figures. Defaults to True.
+        profile (bool, optional): Whether to record the cost of each stage and write profile_report.csv. Defaults to False.
+        workers (int, optional): The number of worker processes, each analysing a file. Defaults to 1.
+        day_workers (int, optional): The number of worker processes sharing the dates of each file, for a few long sessions. Defaults to 1.
+        memory_budget (float, optional): The memory in GiB the worker processes may use together. The files are then started largest first
+                                         when their estimated peak memory fits in the budget (see scheduling.py). Defaults to None, no budget.
+                                         Needs workers above 1 and cannot be combined with day_workers above 1.
+    """
+    if memory_budget is not None and workers <= 1:
+        # a single file runs at a time, there is nothing to pack under the budget
+        raise ValueError("memory_budget needs workers above 1")
+    if memory_budget is not None and day_workers > 1:
+        # the processes sharing the dates of a file are not measured by the memory model, the budget could be exceeded silently
+        raise ValueError("memory_budget cannot be combined with day_workers above 1")
     # check if the output directory exists
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
     completeFileList = [os.path.join(path, name) for path, subdirs, files in os.walk(input_dir) for name in files if name.endswith(".parquet")]
-    
-
-    for file in tqdm(completeFileList, desc="Processing files", dynamic_ncols=True):
-        print(f"Loading {file}")
-        data_frame = analysis.load_from_parquet(file)
-        data_frame = analysis.check_data(data_frame)
-        
-        file_base = os.path.basename(file) # get the file name without the path
-        # get file name without extension
-        file_base = os.path.splitext(file_base)[0]
-        total_duration = analysis.get_data_duration(data_frame)
-        if total_duration > timedelta(hours=24):
-            print(f"Processing {file_base} with duration {total_duration}")
-            data_frame = analysis.remove_daily_outliers(data_frame,outlierThreshold=4)
-            resampled_data_frame = analysis.resample_data(data_frame, 60)
-            workDays = analysis.get_workday(resampled_data_frame)
-            data_frame = analysis.remove_daily_out_work_hours(data_frame, workDays)
-            print(f"Computing threshold and transitions for {file_base}")
-            data_frame = analysis.compute_daily_threshold(data_frame, minDistance=150)
-            data_frame = analysis.compute_sitting_and_standing(data_frame)
-            data_frame = analysis.compute_sit_stand_transitions(data_frame)
-            data_frame = analysis.compute_present_to_absent_transitions(data_frame)
-
-            print(f"Computing metrics for {file_base}")
-            percStanding = analysis.get_sitting_and_standing_percentage(data_frame)
-            transition = analysis.get_sit_stand_transitions(data_frame)
-            transition = analysis.filter_transitions(transition, minDuration=120, transitionName1="TransitionToUP", transitionName2="TransitionToDown")
-            presenceTransition = analysis.get_present_to_absent_transitions(data_frame, minDuration=60)
-            bouts = analysis.compute_bouts(transition, presenceTransition)
-
-            dailyTransitions = analysis.get_num_of_daily_transition(transition)
-            timeAtDesk = analysis.get_time_at_desk(data_frame)
-            
-            data_frame = analysis.resample_data(data_frame, 60)
-            print(f"Exporting summary for {file_base}")
-            analysis.SummaryExport(output_dir, file_base, dailyTransitions, percStanding, workDays, bouts)
-            
-            print(f"Plotting figures for {file_base}")
-            figures = {}
-            fig = plotting.plot_data(data_frame, numdays=total_duration.days)
-            fig = plotting.plot_threshold(data_frame,fig)
-            fig = plotting.plot_transitions(fig,transition)
-            fig = plotting.plot_presence_transitions(fig,presenceTransition)
-            fig = plotting.plot_bouts(fig, bouts)
-            figures["time_series"] = fig
-
-            fig = plotting.plot_workday(workDays)
-            figures["workday"] = fig
-            fig = plotting.plot_time_at_desk(timeAtDesk)
-            figures["time_at_desk"] = fig
-            fig = plotting.plot_sitting_and_standing_percentage(percStanding)
-            figures["sitting_standing"] = fig
-
-            print(f"Saving figures for {file_base}")
-            for name, fig in tqdm(figures.items(), desc="Saving figures", dynamic_ncols=True):
-                outFile = os.path.join(output_dir, f"{name}_{file_base}.html")
-                pio.write_html(fig, outFile)
-    
\ No newline at end of file
+
+    records = []
+    hourlySummaries = []
+    if memory_budget is not None:
+        model = scheduling.MemoryModel(rowCost=scheduling.DEFAULT_PLOT_ROW_COST if plots else scheduling.DEFAULT_ROW_COST)
+        # the number of rows is read from the parquet footers, the files are not loaded
+        jobs = [(scheduling.get_row_count(file), (file, output_dir, summary, plots, profile, day_workers)) for file in completeFileList]
+        results = scheduling.run_with_memory_budget(run_file, jobs, workers, int(memory_budget * 2**30), model)
+        for args, result in tqdm(results, total=len(jobs), desc="Processing files", dynamic_ncols=True):
+            if isinstance(result, Exception):
+                print(f"Error processing file {args[0]}: {result}")
+                continue
+            fileRecords, hourlySummary = result
+            records += fileRecords
+            hourlySummaries.append(hourlySummary)
+        print(f"Calibrated memory model: {model.rowCost:.0f} bytes per row, {model.workerMemory / 2**20:.0f} MiB per worker")
+    elif workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(run_file, file, output_dir, summary, plots, profile, day_workers): file for file in completeFileList}
+            for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures), desc="Processing files", dynamic_ncols=True):
+                try:
+                    fileRecords, hourlySummary = future.result()
+                    records += fileRecords
+                    hourlySummaries.append(hourlySummary)
+                except Exception as e:
+                    print(f"Error processing file {futures[future]}: {e}")
+    else:
+        for file in tqdm(completeFileList, desc="Processing files", dynamic_ncols=True):
+            fileRecords, hourlySummary = run_file(file, output_dir, summary, plots, profile, day_workers)
+            records += fileRecords
+            hourlySummaries.append(hourlySummary)
+    if summary:
+        cohortPath = analysis.CohortExport(output_dir, hourlySummaries)
+        if cohortPath:
+            print(f"Cohort summary saved to {cohortPath}")
+    if profile:
+        print(profiling.write_batch_report(output_dir, records))
+
+def parse_arguments():
+    """Summary: Parse the command line arguments
+
+    Returns:
+        argparse.Namespace: The parsed arguments
+    """
+    parser = argparse.ArgumentParser(description="Analyse the parquet files produced by convert.py. Folder pickers are shown for the folders that are not given.")
+    parser.add_argument("input_dir", nargs="?", help="folder containing the parquet files")
+    parser.add_argument("output_dir", nargs="?", help="folder to save the summaries and figures to")
+    parser.add_argument("--no-plots", action="store_true", help="do not plot and save the html figures")
+    parser.add_argument("--no-summary", action="store_true", help="do not export the summary csv files and the cohort table")
+    parser.add_argument("--summary-only", action="store_true", help="only export the summary csv files, same as --no-plots")
+    parser.add_argument("--workers", type=int, default=1, help="number of files analysed in parallel (default: 1)")
+    parser.add_argument("--day-workers", type=int, default=1,
+                        help="number of processes sharing the dates of each file, for a few long sessions (default: 1)")
+    parser.add_argument("--memory-budget", type=float, default=None, metavar="GIB",
+                        help="memory the --workers processes may use together, files are packed on the workers to stay under it")
+    parser.add_argument("--profile", action="store_true", default=os.environ.get("STANDUP_PROFILE") == "1",
+                        help="record the cost of each stage in profile_<session>.jsonl and profile_report.csv (or set STANDUP_PROFILE=1)")
+    args = parser.parse_args()
+    if args.memory_budget is not None and args.workers <= 1:
+        parser.error("--memory-budget needs --workers above 1, a single file runs at a time without it")
+    if args.memory_budget is not None and args.day_workers > 1:
+        parser.error("--memory-budget cannot be combined with --day-workers above 1, the day worker processes are not counted in the budget")
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    input_dir = args.input_dir
+    output_dir = args.output_dir
+    if not input_dir or not output_dir:
+        # fall back to the folder pickers when the folders are not given on the command line
+        import tkinter as tk
+        from tkinter import filedialog
+        root = tk.Tk()
+        root.withdraw()
+    if not input_dir:
+        input_dir = filedialog.askdirectory(title="Select the folder containing the Standup data")
+        if not input_dir:
+            print("No folder selected. Exiting.")
+            exit()
+    if not output_dir:
+        output_dir = filedialog.askdirectory(title="Select the output folder")
+        if not output_dir:
+            print("No output folder selected. Exiting.")
+            exit()
+
+    batch_process_files(input_dir, output_dir, summary=not args.no_summary, plots=not (args.no_plots or args.summary_only),
+                        profile=args.profile, workers=args.workers, day_workers=args.day_workers,
+                        memory_budget=args.memory_budget)
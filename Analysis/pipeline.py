@@ -0,0 +1,216 @@
+"""
+This script declares the stages of the analysis of a session as a dependency graph and evaluates them lazily.
+Each stage is a function registered with the stage decorator together with the names of the stages it takes as input.
+A Session only runs a stage when its result is asked for, e.g. session.summary or session.figures['time_series'],
+runs the stages it depends on first and keeps every result so that the other outputs of the session reuse them.
+
+Usage:
+    session = pipeline.Session("output/0000_A000.parquet")
+    session.summary                      # runs load -> ... -> bouts, no plotting
+    session.figures['time_series']      # reuses the stages already run
+"""
+
+import os
+from collections.abc import Mapping
+import analysis
+import profiling
+
+# name of the stage: (function, names of the stages passed to the function)
+STAGES = {}
+# name of the figure: name of the stage that plots it
+FIGURES = {
+    "time_series": "time_series_figure",
+    "workday": "workday_figure",
+    "time_at_desk": "time_at_desk_figure",
+    "sitting_standing": "sitting_standing_figure",
+}
+
+
+def stage(*dependencies):
+    """Summary: Register a function as a stage of the analysis. The function is called with the session followed by the results of its dependencies.
+
+    Args:
+        *dependencies (str): The names of the stages the function takes as input
+
+    Returns:
+        function: The decorator registering the function under its name
+    """
+    def register(function):
+        STAGES[function.__name__] = (function, dependencies)
+        return function
+    return register
+
+
+class Figures(Mapping):
+    """Summary: The figures of a session, each one is plotted the first time it is accessed"""
+
+    def __init__(self, session):
+        self.session = session
+
+    def __getitem__(self, name):
+        return self.session.get(FIGURES[name])
+
+    def __iter__(self):
+        return iter(FIGURES)
+
+    def __len__(self):
+        return len(FIGURES)
+
+
+class Session:
+    """Summary: The lazy analysis of a parquet file produced by convert.py. Every stage is available as an attribute, e.g. session.bouts."""
+
+    def __init__(self, file, profiler=None, day_workers=1, minDistance=150, outlierThreshold=4, resamplingPeriod=60):
+        """Summary: Create the session, nothing is loaded until a result is asked for
+
+        Args:
+            file (str): The path to the parquet file
+            profiler (profiling.Profiler, optional): The profiler recording the cost of each stage run. Defaults to a disabled profiler.
+            day_workers (int, optional): The number of worker processes sharing the dates for the transitions. Defaults to 1.
+            minDistance (int, optional): The minimum distance range of a date to compute its threshold. Defaults to 150.
+            outlierThreshold (int, optional): The z-score above which a distance is an outlier. Defaults to 4.
+            resamplingPeriod (int, optional): The resampling period in seconds used for the workdays and the plots. Defaults to 60.
+        """
+        self.file = file
+        # get file name without extension, <participant>_<device> (see convert.py)
+        self.name = os.path.splitext(os.path.basename(file))[0]
+        self.participant, _, self.device = self.name.partition("_")
+        self.profiler = profiler if profiler is not None else profiling.Profiler(self.name)
+        self.day_workers = day_workers
+        self.minDistance = minDistance
+        self.outlierThreshold = outlierThreshold
+        self.resamplingPeriod = resamplingPeriod
+        self.results = {}
+        self.figures = Figures(self)
+
+    def get(self, name):
+        """Summary: Get the result of a stage, running it and the stages it depends on if they have not run yet
+
+        Args:
+            name (str): The name of the stage
+
+        Returns:
+            object: The result of the stage
+        """
+        if name not in self.results:
+            function, dependencies = STAGES[name]
+            inputs = [self.get(dependency) for dependency in dependencies]
+            rowsIn = len(inputs[0]) if len(inputs) > 0 and hasattr(inputs[0], "__len__") else None
+            with self.profiler.stage(name, rowsIn) as record:
+                result = function(self, *inputs)
+                record["rows_out"] = len(result) if hasattr(result, "__len__") else None
+            self.results[name] = result
+        return self.results[name]
+
+    def __getattr__(self, name):
+        # only called for the attributes that are not set, i.e. the stages
+        if name in STAGES:
+            return self.get(name)
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+
+@stage()
+def raw(session):
+    return analysis.load_from_parquet(session.file)
+
+@stage("raw")
+def checked(session, raw):
+    return analysis.check_data(raw)
+
+@stage("checked")
+def duration(session, checked):
+    return analysis.get_data_duration(checked)
+
+@stage("checked")
+def cleaned(session, checked):
+    return analysis.remove_daily_outliers(checked, outlierThreshold=session.outlierThreshold)
+
+@stage("cleaned")
+def resampled(session, cleaned):
+    return analysis.resample_data(cleaned, session.resamplingPeriod)
+
+@stage("resampled")
+def workdays(session, resampled):
+    return analysis.get_workday(resampled)
+
+@stage("cleaned", "workdays")
+def work_hours(session, cleaned, workdays):
+    return analysis.remove_daily_out_work_hours(cleaned, workdays)
+
+@stage("work_hours")
+def states(session, work_hours):
+    # shallow copy so that the threshold column is not added to the cached work_hours data frame
+    data_frame = analysis.compute_daily_threshold(work_hours.copy(deep=False), minDistance=session.minDistance)
+    return analysis.compute_sitting_and_standing(data_frame)
+
+@stage("states")
+def transition_states(session, states):
+    return analysis.compute_transitions_sharded(states, workers=session.day_workers)
+
+@stage("transition_states")
+def perc_standing(session, transition_states):
+    return analysis.get_sitting_and_standing_percentage(transition_states)
+
+@stage("transition_states")
+def transitions(session, transition_states):
+    transition = analysis.get_sit_stand_transitions(transition_states)
+    return analysis.filter_transitions(transition, minDuration=120, transitionName1="TransitionToUP", transitionName2="TransitionToDown")
+
+@stage("transition_states")
+def presence_transitions(session, transition_states):
+    return analysis.get_present_to_absent_transitions(transition_states, minDuration=60)
+
+@stage("transitions", "presence_transitions")
+def bouts(session, transitions, presence_transitions):
+    return analysis.compute_bouts(transitions, presence_transitions)
+
+@stage("transitions")
+def daily_transitions(session, transitions):
+    return analysis.get_num_of_daily_transition(transitions)
+
+@stage("daily_transitions", "perc_standing", "workdays", "bouts")
+def summary(session, daily_transitions, perc_standing, workdays, bouts):
+    return analysis.get_summary_data(daily_transitions, perc_standing, workdays, bouts)
+
+@stage("transition_states", "transitions", "bouts")
+def hourly_summary(session, transition_states, transitions, bouts):
+    hourlySummary = analysis.compute_hourly_summary(transition_states, transitions, bouts)
+    device = session.device
+    if 'Device' in transition_states.columns:
+        # a participant merged over all their devices (convert.py --merge-devices)
+        device = "+".join(sorted(transition_states['Device'].astype(str).unique()))
+    hourlySummary.insert(0, 'Participant', session.participant)
+    hourlySummary.insert(1, 'Device', device)
+    return hourlySummary
+
+@stage("transition_states")
+def time_at_desk(session, transition_states):
+    return analysis.get_time_at_desk(transition_states)
+
+@stage("transition_states")
+def plot_data(session, transition_states):
+    return analysis.resample_data(transition_states, session.resamplingPeriod)
+
+@stage("plot_data", "duration", "transitions", "presence_transitions", "bouts")
+def time_series_figure(session, plot_data, duration, transitions, presence_transitions, bouts):
+    import plotting
+    fig = plotting.plot_data(plot_data, numdays=duration.days)
+    fig = plotting.plot_threshold(plot_data, fig)
+    fig = plotting.plot_transitions(fig, transitions)
+    fig = plotting.plot_presence_transitions(fig, presence_transitions)
+    return plotting.plot_bouts(fig, bouts)
+
+@stage("workdays")
+def workday_figure(session, workdays):
+    import plotting
+    return plotting.plot_workday(workdays)
+
+@stage("time_at_desk")
+def time_at_desk_figure(session, time_at_desk):
+    import plotting
+    return plotting.plot_time_at_desk(time_at_desk)
+
+@stage("perc_standing")
+def sitting_standing_figure(session, perc_standing):
+    import plotting
+    return plotting.plot_sitting_and_standing_percentage(perc_standing)
@@ -11,22 +11,34 @@ import plotly.express as px
 import plotly.io as pio
 import pandas as pd
 import os
+import json
 import numpy as np
+import pyarrow as pa
+import pyarrow.feather as feather
 from datetime import datetime, timedelta
 from tqdm import tqdm
+import analysis
+import convert
+
+# merged data cache written in the participant data folder
+CACHE_FILE = "merged_data.feather"
+MANIFEST_FILE = "merged_data_manifest.json"
+CACHE_VERSION = 1
+# merged csv written by previous versions of this script, it is not a source file
+LEGACY_CACHE_FILE = "merged_data.csv"
 
 def plot_data(data_frame, start_datetime, end_datetime):
     """Summary: Plot the standup data from the data frame between the start and end datetime
     
     Args:
-        data_frame (pandas.DataFrame): The data frame containing the standup data
+        data_frame (pandas.DataFrame): The data frame containing the standup data, sorted by 'Date time'
         start_datetime (datetime.datetime): The start datetime to plot from
         end_datetime (datetime.datetime): The end datetime to plot to
     """
-    # filter the data frame to only include data between the start and end datetime
-    data_frame = data_frame[(data_frame['Date time'] > start_datetime) & (data_frame['Date time'] < end_datetime)]
-    start_datetime = min(data_frame['Date time'])
-    end_datetime = max(data_frame['Date time'])
+    # slice the data frame to only include data between the start and end datetime, the data frame is sorted so the first and last rows are the min and max
+    data_frame = analysis.get_time_slice(data_frame, start_datetime, end_datetime, inclusive="neither")
+    start_datetime = data_frame['Date time'].iloc[0]
+    end_datetime = data_frame['Date time'].iloc[-1]
     # plot the data using a bar chart where the height of the bar is the distance and the color is the human present. true is green, false is red
     fig = px.bar(data_frame, x='Date time', y='Distance(mm)', color='Human Present',
                  color_discrete_map={True: 'green', False: 'grey'})
@@ -44,31 +56,53 @@ def plot_data(data_frame, start_datetime, end_datetime):
     fig.show()
     return fig
     
-def load_data(root):
-    """Summary: Load data from a directory containing CSV files and merge them into a single DataFrame
+def get_source_files(root):
+    """Summary: Get the files recorded by the devices in a directory (CSV or binary, gzipped or not) along with their modification time and size
+    
+    Args:
+        root (str): The path to the directory containing the recorded files
+        
+    Returns:
+        dict: A dictionary with the file paths relative to root as keys and [mtime, size] as values
+    """
+    # recursively get all the files recorded by the devices, except a merged file from an older version of this script
+    sourceFiles = {}
+    for path, subdirs, files in os.walk(root):
+        for name in files:
+            if not name.endswith(convert.SESSION_FILE_EXTENSIONS) or name == LEGACY_CACHE_FILE:
+                continue
+            file_path = os.path.join(path, name)
+            stat = os.stat(file_path)
+            sourceFiles[os.path.relpath(file_path, root)] = [stat.st_mtime, stat.st_size]
+    return sourceFiles
+
+def load_data(root, fileList=None):
+    """Summary: Load data from a directory containing the recorded files and merge them into a single DataFrame
     
     Args:
-        root (str): The path to the directory containing the CSV files
+        root (str): The path to the directory containing the recorded files
+        fileList (list, optional): The paths of the files to load relative to root. Defaults to all the recorded files in root.
         
     Returns:
-        pandas.DataFrame: A merged DataFrame containing the data from all the CSV files
+        pandas.DataFrame: A merged DataFrame containing the data from all the recorded files, sorted by 'Date time'
     """
-    # recursively get all the files in the directory that end with .csv
-    fileList = [os.path.join(path, name) for path, subdirs, files in os.walk(root) for name in files if name.endswith(".csv")]
-    # Loop through each file
-    merged_df = pd.DataFrame()
-
-    # Loop through each CSV file and append its data to the merged DataFrame
-    for file_path in tqdm(fileList):
-        df = pd.read_csv(file_path)
-        #convert the date time column to a datetime object 24h format
-        df['Date time'] = pd.to_datetime(df['Date time'], format='%Y-%m-%d %H:%M:%S')
-        # Append the data to the merged DataFrame
-        merged_df = pd.concat([merged_df, df], ignore_index=True)
-
-    # Display the merged DataFrame
-    print(merged_df)
+    if fileList is None:
+        fileList = list(get_source_files(root).keys())
+    frames = []
+
+    # Loop through each file and collect its data, the frames are concatenated once at the end
+    for file_name in tqdm(fileList):
+        # parses the date time column, reads the gzipped and binary files and expands the runs of the compressed recordings
+        df = convert.read_session_file(os.path.join(root, file_name))
+        if df is not None:
+            frames.append(df)
+
+    if len(frames) == 0:
+        return pd.DataFrame({'Date time': pd.Series(dtype='datetime64[ns]'), 'Distance(mm)': pd.Series(dtype=float), 'Human Present': pd.Series(dtype=bool)})
+    merged_df = pd.concat(frames, ignore_index=True)
     merged_df['Human Present'] = np.where(merged_df['Human Present'] == 0, False, True)
+    # sort by date time so that date ranges can be sliced with a binary search
+    merged_df = merged_df.sort_values(by='Date time', kind='stable').reset_index(drop=True)
     return merged_df
 
 def write_to_csv(data_frame, file_name):
@@ -83,25 +117,82 @@ def write_to_csv(data_frame, file_name):
     #convert the date time column to a string
     data_frame.to_csv(file_name, index=False)
 
+def write_to_feather(data_frame, file_name):
+    """Summary: Write the data frame to an uncompressed feather file so that it can be memory mapped when read back.
+                The file is written next to the destination and then swapped in so a reader never sees a partial file.
+    
+    Args:   
+        data_frame (pandas.DataFrame): The data frame to write
+        file_name (str): The path to the output file
+    """
+    tempFile = f"{file_name}.tmp"
+    feather.write_feather(pa.Table.from_pandas(data_frame, preserve_index=False), tempFile, compression='uncompressed')
+    os.replace(tempFile, file_name)
+
+def load_cached_data(root):
+    """Summary: Load the merged data of a directory from its feather cache, merging in any recorded files added since the cache was written.
+                The cache is rebuilt from scratch if a file it was built from has been modified or removed.
+    
+    Args:
+        root (str): The path to the directory containing the recorded files
+        
+    Returns:
+        pandas.DataFrame: A merged DataFrame containing the data from all the recorded files, sorted by 'Date time'
+    """
+    cacheFile = os.path.join(root, CACHE_FILE)
+    manifestFile = os.path.join(root, MANIFEST_FILE)
+    sourceFiles = get_source_files(root)
+
+    # read the manifest of the files the cache was built from
+    manifest = None
+    if os.path.exists(cacheFile) and os.path.exists(manifestFile):
+        try:
+            with open(manifestFile, 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = None
+
+    merged_df = None
+    newFiles = list(sourceFiles.keys())
+    if manifest is not None and manifest.get('version') == CACHE_VERSION:
+        cachedFiles = manifest['files']
+        # a cached file that changed or disappeared means its rows can't be removed from the cache, rebuild everything,
+        # unless it was only gzipped by the device (upload_compression = gzip), its rows are then already in the cache
+        gzippedFiles = {name + ".gz" for name in cachedFiles if name not in sourceFiles and name + ".gz" in sourceFiles}
+        if all((name in sourceFiles and sourceFiles[name] == value) or name + ".gz" in gzippedFiles for name, value in cachedFiles.items()):
+            merged_df = feather.read_table(cacheFile, memory_map=True).to_pandas()
+            newFiles = [name for name in sourceFiles if name not in cachedFiles and name not in gzippedFiles]
+            if len(newFiles) == 0:
+                return merged_df
+            print(f"Merging {len(newFiles)} new files into {CACHE_FILE}")
+        else:
+            print(f"Source files changed, rebuilding {CACHE_FILE}")
+
+    new_df = load_data(root, newFiles)
+    if merged_df is not None:
+        merged_df = pd.concat([merged_df, new_df], ignore_index=True)
+        # both parts are already sorted so the stable sort only has to merge two runs
+        merged_df = merged_df.sort_values(by='Date time', kind='stable').reset_index(drop=True)
+    else:
+        merged_df = new_df
+
+    # write the cache before the manifest so a manifest always describes a complete cache
+    write_to_feather(merged_df, cacheFile)
+    tempFile = f"{manifestFile}.tmp"
+    with open(tempFile, 'w') as f:
+        json.dump({'version': CACHE_VERSION, 'files': sourceFiles}, f)
+    os.replace(tempFile, manifestFile)
+    return merged_df
+
 
 if __name__ == "__main__":
 
     #open windows folder picker
     root = filedialog.askdirectory(title="Select the folder containing the participant data.", initialdir = os.getcwd())
-    # check if there is a file called merged_data.csv in the folder
-    if os.path.exists(os.path.join(root, "merged_data.csv")):
-        #load the data from the file
-        merged_df = pd.read_csv(os.path.join(root, "merged_data.csv"))
-        # convert the date time column to a datetime object
-        merged_df['Date time'] = pd.to_datetime(merged_df['Date time'], format='%Y-%m-%d %H:%M:%S')
-    else:
-        #load the data from the folder
-        merged_df = load_data(root)
-        destination = os.path.join(root, "merged_data.csv")
-        write_to_csv(merged_df, destination)
+    # load the merged data from the cache in the folder, only new or modified files are read from the recorded files
+    merged_df = load_cached_data(root)
     start = datetime(2023,11,17,8,0,0)
     stop = datetime(2023,11,30,17,0,0)
     fig = plot_data(merged_df, start, stop)
     # save plot to html
-    pio.write_html(fig, os.path.join(root,"standup_data.html"))
-    
\ No newline at end of file
+    pio.write_html(fig, os.path.join(root,"standup_data.html"))
\ No newline at end of file
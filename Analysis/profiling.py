@@ -0,0 +1,108 @@
+"""
+This script provides an opt-in instrumentation layer for the analysis pipeline. Each stage of a session is wrapped in Profiler.stage,
+which records its wall time, CPU time, number of rows in and out and peak memory. The records of a session are written as a JSON lines file
+and the records of a whole batch can be aggregated into a report of the cost of each stage.
+
+Peak memory is measured with tracemalloc, which tracks the allocations made by Python, numpy and pandas but not the Arrow memory pool.
+Tracing slows down stages that allocate many small Python objects (the plotly figures mostly), so compare profiled runs with profiled runs.
+"""
+
+import os
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+import pandas as pd
+
+
+class Profiler:
+    """Summary: Records the cost of each stage of the analysis of a session. A disabled profiler records nothing and adds no overhead."""
+
+    def __init__(self, session, enabled=False):
+        """Summary: Create a profiler for a session
+
+        Args:
+            session (str): The name of the session being analysed
+            enabled (bool, optional): Whether to record the stages. Defaults to False.
+        """
+        self.session = session
+        self.enabled = enabled
+        self.records = []
+        if self.enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """Summary: Record the cost of the code run inside the with block. Set record["rows_out"] in the block to record the number of rows produced.
+
+        Args:
+            name (str): The name of the stage
+            rows_in (int, optional): The number of rows the stage starts from. Defaults to None.
+
+        Yields:
+            dict: The record of the stage
+        """
+        record = {"session": self.session, "stage": name, "rows_in": rows_in, "rows_out": None}
+        if not self.enabled:
+            yield record
+            return
+        tracemalloc.reset_peak()
+        startMemory = tracemalloc.get_traced_memory()[0]
+        startWall = time.perf_counter()
+        startCpu = time.process_time()
+        try:
+            yield record
+        finally:
+            record["wall_time"] = time.perf_counter() - startWall
+            record["cpu_time"] = time.process_time() - startCpu
+            # peak memory allocated by the stage on top of what was allocated when it started
+            record["peak_memory"] = tracemalloc.get_traced_memory()[1] - startMemory
+            self.records.append(record)
+
+    def write(self, output_dir):
+        """Summary: Write the records of the session to profile_<session>.jsonl, one JSON object per stage
+
+        Args:
+            output_dir (str): The directory to write the file to
+
+        Returns:
+            str: The path of the file written, None if the profiler is disabled
+        """
+        if not self.enabled:
+            return None
+        outputPath = os.path.join(output_dir, f"profile_{self.session}.jsonl")
+        with open(outputPath, 'w') as f:
+            for record in self.records:
+                f.write(json.dumps(record) + "\n")
+        return outputPath
+
+
+def write_batch_report(output_dir, records):
+    """Summary: Aggregate the records of a batch per stage and write them to profile_report.csv
+
+    Args:
+        output_dir (str): The directory to write the report to
+        records (list): The records of all the sessions of the batch
+
+    Returns:
+        pandas.DataFrame: The report with one row per stage, None if there are no records
+    """
+    if len(records) == 0:
+        return None
+    data_frame = pd.DataFrame(records)
+    # keep the stages in the order they run in
+    stageOrder = list(dict.fromkeys(data_frame['stage']))
+    report = data_frame.groupby('stage').agg(
+        sessions=('session', 'nunique'),
+        total_wall_time=('wall_time', 'sum'),
+        mean_wall_time=('wall_time', 'mean'),
+        max_wall_time=('wall_time', 'max'),
+        total_cpu_time=('cpu_time', 'sum'),
+        max_peak_memory=('peak_memory', 'max'),
+        total_rows_in=('rows_in', 'sum'),
+        total_rows_out=('rows_out', 'sum'),
+    ).reindex(stageOrder)
+    report['wall_time_share'] = report['total_wall_time'] / report['total_wall_time'].sum()
+    report = report.reset_index()
+    report.to_csv(os.path.join(output_dir, "profile_report.csv"), index=False)
+    return report
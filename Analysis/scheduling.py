@@ -0,0 +1,177 @@
+"""
+This script schedules the analysis of a batch of sessions on worker processes under a memory budget.
+The peak memory of a session is estimated from its number of rows, read from the Parquet footer without loading the file,
+times a cost per row. Sessions are started largest first as long as the estimates of the running sessions fit in the budget,
+so that many small sessions run side by side while a very long session runs with fewer or no neighbours.
+Every worker reports the peak memory it reached for its session and the cost per row is raised from these measurements as the batch proceeds,
+never lowered below the default: the first sessions to finish are the small ones, whose peak is mostly the cost per session.
+
+The peak memory is read from /proc/self/status (VmHWM), which is reset before each session, so it is only measured on Linux.
+Elsewhere the default costs are used for the whole batch. A worker keeps most of the memory of its previous sessions, so the
+memory of the workers before their sessions is tracked as well and the largest one is reserved for every worker started.
+"""
+
+import concurrent.futures
+
+# default peak memory of a session above the idle memory of its worker, measured on synthetic sessions (see synthetic_data.py)
+DEFAULT_ROW_COST = 800              # bytes per row for the summaries
+DEFAULT_PLOT_ROW_COST = 2500        # bytes per row when the figures are plotted as well
+DEFAULT_SESSION_COST = 20 * 2**20   # bytes per session regardless of its size
+DEFAULT_WORKER_MEMORY = 150 * 2**20 # bytes of an idle worker with pandas and pyarrow imported
+
+
+def get_row_count(path):
+    """Summary: Get the number of rows of a parquet file from its footer, without reading the data
+
+    Args:
+        path (str): The path to the parquet file
+
+    Returns:
+        int: The number of rows
+    """
+    import pyarrow.parquet as pq
+    return pq.ParquetFile(path).metadata.num_rows
+
+def reset_peak_memory():
+    """Summary: Reset the peak memory of this process to its current memory so that the next peak measured is the one of the next task
+
+    Returns:
+        bool: True if the peak was reset, False if the platform does not support it
+    """
+    try:
+        with open("/proc/self/clear_refs", 'w') as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def get_memory_usage():
+    """Summary: Get the current and peak resident memory of this process
+
+    Returns:
+        tuple: The current and peak memory in bytes, (None, None) if the platform does not report them
+    """
+    current = peak = None
+    try:
+        with open("/proc/self/status", 'r') as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    current = int(line.split()[1]) * 1024
+                elif line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return current, peak
+
+def run_measured(function, *args):
+    """Summary: Run a task in a worker process and measure the peak memory it needed
+
+    Args:
+        function (function): The task, a picklable function
+        *args: The arguments of the task
+
+    Returns:
+        tuple: The result of the task, the memory of the worker before the task and the peak memory the task added to it in bytes
+               (None when the platform does not report them)
+    """
+    measured = reset_peak_memory()
+    startMemory, _ = get_memory_usage()
+    result = function(*args)
+    _, peakMemory = get_memory_usage()
+    if not measured or startMemory is None or peakMemory is None:
+        return result, None, None
+    return result, startMemory, peakMemory - startMemory
+
+
+class MemoryModel:
+    """Summary: Estimates the peak memory of a session from its number of rows, recalibrated from the peaks measured during the batch"""
+
+    def __init__(self, rowCost=DEFAULT_ROW_COST, sessionCost=DEFAULT_SESSION_COST, workerMemory=DEFAULT_WORKER_MEMORY):
+        """Summary: Create the model with the default costs used until the first measurements
+
+        Args:
+            rowCost (int, optional): The peak memory per row in bytes. Defaults to DEFAULT_ROW_COST.
+            sessionCost (int, optional): The peak memory per session regardless of its size in bytes. Defaults to DEFAULT_SESSION_COST.
+            workerMemory (int, optional): The memory of an idle worker process in bytes. Defaults to DEFAULT_WORKER_MEMORY.
+        """
+        self.rowCost = rowCost
+        self.sessionCost = sessionCost
+        self.workerMemory = workerMemory
+        self.measurements = [] # [(rows, peak memory)]
+
+    def estimate(self, rows):
+        """Summary: Estimate the peak memory a session adds to its worker
+
+        Args:
+            rows (int): The number of rows of the session
+
+        Returns:
+            float: The estimated peak memory in bytes
+        """
+        return self.sessionCost + rows * self.rowCost
+
+    def update(self, rows, peakMemory, workerMemory=None):
+        """Summary: Recalibrate the cost per row from the peak memory measured for a session.
+                    The cost per row is only raised, never below the default or the largest cost measured, so that the estimates stay on the safe side:
+                    the peak of a small session is mostly the cost per session and would give a cost per row close to 0.
+
+        Args:
+            rows (int): The number of rows of the session
+            peakMemory (int): The peak memory the session added to its worker in bytes
+            workerMemory (int, optional): The memory of the worker before the session in bytes. Defaults to None.
+        """
+        if rows <= 0 or peakMemory is None:
+            return
+        firstMeasurement = len(self.measurements) == 0
+        self.measurements.append((rows, peakMemory))
+        if workerMemory is not None:
+            self.workerMemory = workerMemory if firstMeasurement else max(self.workerMemory, workerMemory)
+        rowCost = max(0.0, peakMemory - self.sessionCost) / rows
+        self.rowCost = max(self.rowCost, rowCost)
+
+
+def run_with_memory_budget(function, jobs, workers, budget, model=None):
+    """Summary: Run the jobs on worker processes, starting a job only when the estimated peak memory of the running jobs and the
+                memory of the workers stay under the budget. A job estimated to need more than the whole budget runs on its own.
+
+    Args:
+        function (function): The task run for every job, a picklable function taking the job arguments
+        jobs (list): The jobs as tuples of (number of rows, arguments of the task)
+        workers (int): The maximum number of jobs running at the same time
+        budget (int): The memory budget in bytes
+        model (MemoryModel, optional): The memory model. Defaults to MemoryModel().
+
+    Yields:
+        tuple: The arguments and the result of every job, in the order they finish. The result is the exception raised if the job failed.
+    """
+    if model is None:
+        model = MemoryModel()
+    # the largest jobs first, they are the hardest to place
+    pending = sorted(jobs, key=lambda job: job[0], reverse=True)
+    running = {} # {future: (rows, args)}
+    # the executor only starts a new worker process when all the started ones are busy
+    started = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            # start the largest pending jobs that fit next to the running ones
+            available = budget - started * model.workerMemory - sum(model.estimate(rows) for rows, args in running.values())
+            for job in list(pending):
+                if len(running) >= workers:
+                    break
+                rows, args = job
+                estimate = model.estimate(rows) + (model.workerMemory if len(running) >= started else 0)
+                if estimate <= available or len(running) == 0:
+                    pending.remove(job)
+                    running[executor.submit(run_measured, function, *args)] = job
+                    started = max(started, len(running))
+                    available -= estimate
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                rows, args = running.pop(future)
+                try:
+                    result, workerMemory, peakMemory = future.result()
+                except Exception as e:
+                    yield args, e
+                    continue
+                model.update(rows, peakMemory, workerMemory)
+                yield args, result
@@ -0,0 +1,245 @@
+"""
+This script generates synthetic standup device data for testing and benchmarking the analysis scripts.
+The files are written in the same layout as the firmware: data/<ID>/<yymmdd>/<DEV>_<ID>_<yymmdd_HHMMSS>.csv
+with the header "Date time,Distance(mm),Human Present". The generator is seeded so the same settings always produce the same files.
+
+Each participant gets a desk with a sitting and a standing height, arrives and leaves at slightly different times every day,
+takes breaks away from the desk and alternates between sitting and standing bouts. The readings include sensor noise,
+occasional spikes and recording gaps, and the device only records between wake_at and sleep_at like the firmware.
+
+Usage:
+    python synthetic_data.py <output folder> --participants 5 --days 20
+"""
+
+import os
+import argparse
+from dataclasses import dataclass, asdict
+from datetime import datetime, date, timedelta
+import numpy as np
+import pandas as pd
+
+FILE_HEADER = "Date time,Distance(mm),Human Present"
+
+
+@dataclass
+class SyntheticConfig:
+    """Summary: Settings of the synthetic data generator. The defaults follow the firmware config.ini and a typical office day."""
+    participants: int = 1
+    days: int = 5
+    start_date: date = date(2023, 11, 13)
+    skip_weekends: bool = True
+    sampling_period: int = 5            # seconds between samples (SAMPLING_PERIOD)
+    sampling_jitter: float = 0.1        # probability that a sample is one second late
+    new_file_period: int = 120          # seconds per file (NEW_FILE_PERIOD)
+    wake_at: str = "07:30"              # start of the recording hours (WAKE_AT)
+    sleep_at: str = "17:30"             # end of the recording hours (SLEEP_AT)
+    arrival: str = "08:30"              # mean arrival time at the desk
+    departure: str = "16:45"            # mean departure time from the desk
+    arrival_spread: int = 1800          # standard deviation of the arrival and departure times in seconds
+    mean_sitting_bout: int = 2400       # mean duration of a sitting bout in seconds
+    mean_standing_bout: int = 900       # mean duration of a standing bout in seconds
+    mean_break_interval: int = 3600     # mean time between two breaks away from the desk in seconds
+    mean_break_duration: int = 300      # mean duration of a break in seconds
+    noise: float = 4.0                  # standard deviation of the distance noise in mm
+    spike_probability: float = 0.002    # probability that a reading is a sensor spike
+    gap_probability: float = 0.2        # probability that a day has a recording gap
+    mean_gap_duration: int = 1800       # mean duration of a recording gap in seconds
+    seed: int = 0
+
+
+def time_of_day(value):
+    """Summary: Convert a "HH:MM" string to seconds since midnight
+
+    Args:
+        value (str): The time of day
+
+    Returns:
+        int: The number of seconds since midnight
+    """
+    hours, minutes = value.split(":")
+    return int(hours) * 3600 + int(minutes) * 60
+
+def get_recording_dates(config):
+    """Summary: Get the dates the devices record on
+
+    Args:
+        config (SyntheticConfig): The generator settings
+
+    Returns:
+        list: The list of recording dates
+    """
+    dates = []
+    day = config.start_date
+    while len(dates) < config.days:
+        if not config.skip_weekends or day.weekday() < 5:
+            dates.append(day)
+        day += timedelta(days=1)
+    return dates
+
+def get_intervals_mask(seconds, starts, ends):
+    """Summary: Compute which sample times fall inside a set of non overlapping intervals
+
+    Args:
+        seconds (numpy.ndarray): The sorted sample times in seconds since midnight
+        starts (numpy.ndarray): The sorted start times of the intervals
+        ends (numpy.ndarray): The end times of the intervals
+
+    Returns:
+        numpy.ndarray: True for the samples inside an interval
+    """
+    # a sample is inside an interval if the last interval started before it has not ended yet
+    index = np.searchsorted(starts, seconds, side='right') - 1
+    inside = index >= 0
+    inside[inside] = seconds[inside] < ends[index[inside]]
+    return inside
+
+def get_alternating_state(rng, seconds, start, end, mean_false, mean_true):
+    """Summary: Draw a state that alternates between False and True with exponentially distributed durations
+
+    Args:
+        rng (numpy.random.Generator): The random generator
+        seconds (numpy.ndarray): The sorted sample times in seconds since midnight
+        start (float): The start time of the state sequence
+        end (float): The end time of the state sequence
+        mean_false (float): The mean duration of the False periods in seconds
+        mean_true (float): The mean duration of the True periods in seconds
+
+    Returns:
+        numpy.ndarray: The state at every sample time
+    """
+    # draw enough durations to cover the whole period, the sequence always starts with a False period
+    count = int((end - start) / min(mean_false, mean_true)) + 2
+    durations = np.empty(2 * count)
+    durations[0::2] = rng.exponential(mean_false, count)
+    durations[1::2] = rng.exponential(mean_true, count)
+    edges = start + np.cumsum(durations)
+    trueStarts = edges[0::2]
+    trueEnds = edges[1::2]
+    return get_intervals_mask(seconds, trueStarts, trueEnds)
+
+def generate_day(rng, config, profile, day):
+    """Summary: Generate the samples recorded by one device on one date
+
+    Args:
+        rng (numpy.random.Generator): The random generator
+        config (SyntheticConfig): The generator settings
+        profile (dict): The desk heights of the participant
+        day (datetime.date): The date to generate
+
+    Returns:
+        pandas.DataFrame: The samples with the columns 'Date time', 'Distance(mm)' and 'Human Present'
+    """
+    wake = time_of_day(config.wake_at)
+    sleep = time_of_day(config.sleep_at)
+    # sample times, some samples are a second late like on the device
+    periods = config.sampling_period + (rng.random(int((sleep - wake) / config.sampling_period) + 1) < config.sampling_jitter)
+    seconds = wake + np.cumsum(periods) - periods[0]
+    seconds = seconds[seconds <= sleep]
+
+    # recording gap, e.g. the device was unplugged or restarted
+    if rng.random() < config.gap_probability:
+        gapStart = rng.uniform(wake, sleep)
+        gapEnd = gapStart + rng.exponential(config.mean_gap_duration)
+        seconds = seconds[(seconds < gapStart) | (seconds >= gapEnd)]
+
+    # presence: between arrival and departure, minus the breaks
+    arrival = time_of_day(config.arrival) + rng.normal(0, config.arrival_spread)
+    departure = time_of_day(config.departure) + rng.normal(0, config.arrival_spread)
+    atDesk = (seconds >= arrival) & (seconds < departure)
+    onBreak = get_alternating_state(rng, seconds, arrival, departure, config.mean_break_interval, config.mean_break_duration)
+    present = atDesk & ~onBreak
+
+    # desk height: alternating sitting and standing bouts, the desk is lowered when the participant leaves
+    standing = get_alternating_state(rng, seconds, arrival, departure, config.mean_sitting_bout, config.mean_standing_bout) & atDesk
+    distance = np.where(standing, profile['standing_height'], profile['sitting_height'])
+    distance = distance + rng.normal(0, config.noise, len(seconds))
+    spikes = rng.random(len(seconds)) < config.spike_probability
+    distance[spikes] = rng.uniform(0, 2 * profile['standing_height'], spikes.sum())
+
+    midnight = np.datetime64(day, 's')
+    return pd.DataFrame({
+        'Date time': midnight + seconds.astype('timedelta64[s]'),
+        'Distance(mm)': np.clip(np.rint(distance), 0, None).astype(np.int64),
+        'Human Present': present.astype(np.int64),
+    })
+
+def write_device_files(data_frame, output_dir, participant_id, device_id, new_file_period):
+    """Summary: Write the samples of a date in files of new_file_period seconds, named and organised like the firmware does
+
+    Args:
+        data_frame (pandas.DataFrame): The samples of one date
+        output_dir (str): The root output directory, the files are written in <output_dir>/data/<ID>/<yymmdd>/
+        participant_id (str): The participant id
+        device_id (str): The device id
+        new_file_period (int): The number of seconds covered by each file
+
+    Returns:
+        list: The paths of the files written
+    """
+    if data_frame.empty:
+        return []
+    times = data_frame['Date time']
+    folder = os.path.join(output_dir, "data", participant_id, times.iloc[0].strftime("%y%m%d"))
+    os.makedirs(folder, exist_ok=True)
+    # format every row once then split the lines into files
+    lines = (times.dt.strftime('%Y-%m-%d %H:%M:%S') + "," + data_frame['Distance(mm)'].astype(str) + "," + data_frame['Human Present'].astype(str)).tolist()
+    seconds = (times - times.iloc[0]).dt.total_seconds().to_numpy()
+    fileStarts = np.flatnonzero(np.diff(seconds // new_file_period, prepend=-1))
+    paths = []
+    for start, stop in zip(fileStarts, np.append(fileStarts[1:], len(lines))):
+        fileName = f"{device_id}_{participant_id}_{times.iloc[start].strftime('%y%m%d_%H%M%S')}.csv"
+        path = os.path.join(folder, fileName)
+        with open(path, 'w', newline='') as f:
+            f.write(FILE_HEADER + "\r\n" + "\r\n".join(lines[start:stop]) + "\r\n")
+        paths.append(path)
+    return paths
+
+def generate_dataset(output_dir, config=None, **kwargs):
+    """Summary: Generate the synthetic data of all the participants and write it in the firmware layout
+
+    Args:
+        output_dir (str): The root output directory
+        config (SyntheticConfig, optional): The generator settings. Defaults to SyntheticConfig().
+        **kwargs: Settings overriding the ones of config
+
+    Returns:
+        dict: A dictionary with the session id (participant_device, as in convert.py) as keys and the list of file paths as values
+    """
+    if config is None:
+        config = SyntheticConfig()
+    if kwargs:
+        config = SyntheticConfig(**{**asdict(config), **kwargs})
+    rng = np.random.default_rng(config.seed)
+    sessions = {}
+    for participant in range(config.participants):
+        participant_id = f"{participant:04d}"
+        device_id = f"{0xA000 + participant:04X}"
+        profile = {
+            'sitting_height': rng.normal(250, 30),
+            'standing_height': rng.normal(650, 40),
+        }
+        paths = []
+        for day in get_recording_dates(config):
+            data_frame = generate_day(rng, config, profile, day)
+            paths += write_device_files(data_frame, output_dir, participant_id, device_id, config.new_file_period)
+        sessions[f"{participant_id}_{device_id}"] = paths
+    return sessions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic standup device data in the firmware file layout")
+    parser.add_argument("output_dir", help="folder to write the data folder to")
+    parser.add_argument("--participants", type=int, default=SyntheticConfig.participants)
+    parser.add_argument("--days", type=int, default=SyntheticConfig.days)
+    parser.add_argument("--sampling-period", type=int, default=SyntheticConfig.sampling_period)
+    parser.add_argument("--new-file-period", type=int, default=SyntheticConfig.new_file_period)
+    parser.add_argument("--noise", type=float, default=SyntheticConfig.noise)
+    parser.add_argument("--gap-probability", type=float, default=SyntheticConfig.gap_probability)
+    parser.add_argument("--mean-sitting-bout", type=int, default=SyntheticConfig.mean_sitting_bout)
+    parser.add_argument("--mean-standing-bout", type=int, default=SyntheticConfig.mean_standing_bout)
+    parser.add_argument("--seed", type=int, default=SyntheticConfig.seed)
+    args = parser.parse_args()
+
+    sessions = generate_dataset(args.output_dir, SyntheticConfig(**{key: value for key, value in vars(args).items() if key != "output_dir"}))
+    for session, paths in sessions.items():
+        print(f"{session}: {len(paths)} files")
@@ -19,7 +19,7 @@ from googleapiclient.http import MediaFileUpload
 from google.oauth2 import service_account
 
 
-from shared_resources import DATA_DIR,CONFIG_FILE,DEVICE_ID,ROOT_DIR
+from shared_resources import DATA_DIR,CONFIG_FILE,DEVICE_ID,ROOT_DIR,DATA_FILE_EXTENSIONS
 
 # Constants
 SCOPES = ["https://www.googleapis.com/auth/drive"]
@@ -148,7 +148,7 @@ def upload_file(service, file_path, parent_folder_id):
 def clone_folder_structure(service, local_folder, parent_folder_id):
     """
     Recursively clones the folder structure of a local folder to a Google Drive folder.
-    If a file with extension .csv is found, it is uploaded to the Google Drive folder.
+    If a recorded file (.csv or .bin, gzipped or not) is found, it is uploaded as it is to the Google Drive folder.
     If the file already exists in the Google Drive folder, it is deleted from the local folder.
 
     Args:
@@ -171,8 +171,8 @@ def clone_folder_structure(service, local_folder, parent_folder_id):
             else:
                 clone_folder_structure(service, item_path, folder_id)
         else: # if item is a file, upload it
-            # check if file extension is .csv
-            if item_path.endswith(".csv"):
+            # check if the file is a recorded file, CSV or binary
+            if item_path.endswith(DATA_FILE_EXTENSIONS):
                 print(f"checking if {item_path} exists")
                 file_exists = check_if_already_exist(item_path, service, folder_id)
                 if not file_exists:
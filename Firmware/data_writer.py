@@ -0,0 +1,519 @@
+"""
+File: data_writer.py
+Description: Buffered writer for the sensor data. The file being recorded stays open in the temp folder, rows are kept in memory
+             and written on every flush, and a small journal records how many bytes of the file are on disk after each flush.
+             When the file is complete it is closed and moved to its folder in the data folder.
+             At startup, recover_temp_files uses the journal to cut the temp files back to their last complete flush and move them to the data folder,
+             so a power loss loses at most the rows of one flush interval (with compression = deadband, see below, also the run in progress).
+
+             The samples are written as CSV rows or, with file_format = binary in config.ini, as fixed width binary records:
+                 header  8 bytes: magic b"SDSB", format version (uint8), record size (uint8), 2 reserved bytes
+                 record  7 bytes, little endian: time (uint32, seconds since 1970-01-01 of the RTC time), distance in mm (uint16), flags (uint8)
+             The RTC time has no time zone, it is stored as if it were UTC so that it decodes to the same wall clock time as the CSV rows.
+             A distance that could not be read is stored as MISSING_DISTANCE. Bit 0 of the flags is the presence.
+             The binary files are decoded by Analysis/convert.py, which must be updated together with this format.
+
+             With compression = deadband in config.ini, the samples are run length encoded by DeadbandEncoder: a row is only written when
+             the distance moves beyond the deadband from the first sample of the run, the presence changes or the heartbeat period has passed,
+             and it carries the number of samples it stands for in a 'Samples' column (format version 2 of the binary records, 9 bytes with
+             a uint16 count). Analysis/convert.py expands the runs back to one row per sample.
+             The run in progress is kept by the encoder and only written when it ends, a flush does not write it, so a power loss
+             loses up to heartbeat_period + write_period seconds of samples instead of one flush interval.
+
+             With upload_compression = gzip in config.ini, the upload thread gzips the closed files of the data folder before uploading them
+             (compress_data_files), the .csv.gz and .bin.gz files are read by Analysis/convert.py as they are.
+"""
+import os
+import csv
+import gzip
+import json
+import shutil
+import struct
+import calendar
+
+JOURNAL_FILE = "journal.json"
+# when the data is forced to the flash with fsync:
+#   "flush": after every flush, a power loss loses at most the rows of one flush interval
+#   "close": only when a file is closed, fewer flash writes but the rows written since the last close may be lost
+#   "never": left to the operating system
+FSYNC_POLICIES = ("flush", "close", "never")
+FILE_FORMATS = {"csv": ".csv", "binary": ".bin"}
+
+BINARY_MAGIC = b"SDSB"
+BINARY_VERSION = 1
+BINARY_RECORD = struct.Struct("<IHB")
+BINARY_RUN_VERSION = 2
+BINARY_RUN_RECORD = struct.Struct("<IHBH")
+BINARY_HEADER = struct.Struct("<4sBBH")
+MISSING_DISTANCE = 0xFFFF
+MAX_RUN_SAMPLES = 0xFFFF
+PRESENCE_FLAG = 0x01
+RUN_HEADER = "Samples"
+COMPRESSIONS = ("none", "deadband")
+# compression level of the closed files, see test_programs/compression_test.py for the CPU time and size of each level
+GZIP_LEVEL = 6
+# the closed files compressed by compress_data_files
+UNCOMPRESSED_EXTENSIONS = tuple(FILE_FORMATS.values())
+
+
+def fsync_directory(folder):
+    """
+    Make the creation, renaming or removal of the files of a folder durable.
+
+    Args:
+        folder (str): The folder to sync.
+    """
+    fd = os.open(folder, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def write_journal(journal_path, entry, sync=True):
+    """
+    Replace the journal with a new entry. The entry is written to a temporary file which is then renamed, so the journal is never partially written.
+
+    Args:
+        journal_path (str): The path of the journal.
+        entry (dict): The state of the file being recorded.
+        sync (bool): Whether to force the journal to the flash.
+    """
+    tempPath = journal_path + ".tmp"
+    with open(tempPath, 'w') as f:
+        json.dump(entry, f)
+        f.flush()
+        if sync:
+            os.fsync(f.fileno())
+    os.replace(tempPath, journal_path)
+    if sync:
+        fsync_directory(os.path.dirname(journal_path) or ".")
+
+def read_journal(journal_path):
+    """
+    Read the journal.
+
+    Args:
+        journal_path (str): The path of the journal.
+
+    Returns:
+        dict: The state of the file that was being recorded, None if there is no valid journal.
+    """
+    try:
+        with open(journal_path, 'r') as f:
+            entry = json.load(f)
+        return entry if isinstance(entry, dict) else None
+    except (OSError, ValueError):
+        return None
+
+def get_binary_header(runs=False):
+    """
+    Get the header written at the start of a binary file.
+
+    Args:
+        runs (bool): Whether the records are runs with a number of samples (format version 2).
+
+    Returns:
+        bytes: The header.
+    """
+    if runs:
+        return BINARY_HEADER.pack(BINARY_MAGIC, BINARY_RUN_VERSION, BINARY_RUN_RECORD.size, 0)
+    return BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, BINARY_RECORD.size, 0)
+
+def get_binary_record_size(path):
+    """
+    Get the size of the records of a binary file from its header.
+
+    Args:
+        path (str): The path of the file.
+
+    Returns:
+        int: The size of the records in bytes, None if the file is not a binary file.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(BINARY_HEADER.size)
+    if len(header) < BINARY_HEADER.size or not header.startswith(BINARY_MAGIC):
+        return None
+    return BINARY_HEADER.unpack(header)[2]
+
+
+class BinarySampleWriter:
+    """
+    Packs the rows [datetime, distance, presence] or the runs [datetime, distance, presence, samples] into binary records,
+    with the writerows method of csv.writer.
+    """
+
+    def __init__(self, file, runs=False):
+        """
+        Args:
+            file: The file opened in binary mode.
+            runs (bool): Whether the rows are runs with a number of samples.
+        """
+        self.file = file
+        self.runs = runs
+
+    def writerows(self, rows):
+        """
+        Write the rows as binary records.
+
+        Args:
+            rows (list): The rows to write.
+        """
+        records = bytearray()
+        for row in rows:
+            sampleTime, distance, presence = row[:3]
+            # NaN when the distance could not be read
+            if distance != distance or distance is None:
+                distance = MISSING_DISTANCE
+            else:
+                distance = min(max(int(distance), 0), MISSING_DISTANCE - 1)
+            flags = PRESENCE_FLAG if presence else 0
+            if self.runs:
+                records += BINARY_RUN_RECORD.pack(calendar.timegm(sampleTime.timetuple()), distance, flags, row[3])
+            else:
+                records += BINARY_RECORD.pack(calendar.timegm(sampleTime.timetuple()), distance, flags)
+        self.file.write(records)
+
+
+class DeadbandEncoder:
+    """
+    Run length encodes the samples of a desk that stays at the same height: consecutive samples are merged into a run
+    [datetime, distance, presence, samples] holding the first sample and the number of samples it stands for.
+    """
+
+    def __init__(self, deadband, heartbeat_period):
+        """
+        Args:
+            deadband (int): The largest change of distance in mm merged into a run.
+            heartbeat_period (int): The longest duration of a run in seconds, so that a run is written at least this often.
+        """
+        self.deadband = deadband
+        self.heartbeat_period = heartbeat_period
+        self.run = None
+
+    def starts_run(self, row):
+        """
+        Check whether a sample starts a new run.
+
+        Args:
+            row (list): The sample [datetime, distance, presence].
+
+        Returns:
+            bool: True if the sample cannot be merged into the current run.
+        """
+        runTime, runDistance, runPresence, samples = self.run
+        sampleTime, distance, presence = row
+        if presence != runPresence or samples >= MAX_RUN_SAMPLES:
+            return True
+        if (sampleTime - runTime).total_seconds() >= self.heartbeat_period:
+            return True
+        # NaN when the distance could not be read, a run holds either valid or missing distances
+        if distance != distance or runDistance != runDistance:
+            return (distance != distance) != (runDistance != runDistance)
+        return abs(distance - runDistance) > self.deadband
+
+    def add(self, row):
+        """
+        Add a sample to the current run.
+
+        Args:
+            row (list): The sample [datetime, distance, presence].
+
+        Returns:
+            list: The run ended by the sample, None if the sample was merged into the current run.
+        """
+        if self.run is not None and not self.starts_run(row):
+            self.run[3] += 1
+            return None
+        endedRun = self.run
+        self.run = list(row) + [1]
+        return endedRun
+
+    def close(self):
+        """
+        End the current run.
+
+        Returns:
+            list: The current run, None if there is none.
+        """
+        endedRun = self.run
+        self.run = None
+        return endedRun
+
+
+def move_file(source, destination):
+    """
+    Move a file to the data folder, creating its folders. If the destination already exists the file is renamed rather than overwriting it.
+
+    Args:
+        source (str): The path of the file in the temp folder.
+        destination (str): The path of the file in the data folder.
+
+    Returns:
+        str: The path the file was moved to.
+    """
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    base, extension = os.path.splitext(destination)
+    suffix = 1
+    while os.path.exists(destination):
+        destination = f"{base}_{suffix}{extension}"
+        suffix += 1
+    os.rename(source, destination)
+    return destination
+
+
+class BufferedSampleWriter:
+    """
+    Keeps the file being recorded open and writes the rows in batches, as CSV rows or binary records.
+    """
+
+    def __init__(self, journal_path, fsync_policy="flush", file_format="csv", encoder=None):
+        """
+        Args:
+            journal_path (str): The path of the journal, in the temp folder.
+            fsync_policy (str): When the data is forced to the flash, one of FSYNC_POLICIES.
+            file_format (str): The format of the files, one of FILE_FORMATS.
+            encoder (DeadbandEncoder): The encoder merging the samples into runs, None to write every sample.
+        """
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy {fsync_policy}, expected one of {FSYNC_POLICIES}")
+        if file_format not in FILE_FORMATS:
+            raise ValueError(f"Unknown file format {file_format}, expected one of {tuple(FILE_FORMATS)}")
+        self.journal_path = journal_path
+        self.fsync_policy = fsync_policy
+        self.file_format = file_format
+        self.extension = FILE_FORMATS[file_format]
+        self.encoder = encoder
+        self.file = None
+        self.writer = None
+        self.temp_path = None
+        self.destination = None
+        self.rows = []
+        self.samples = 0
+
+    def open(self, temp_path, destination, header):
+        """
+        Start a new file. The header is written with the first flush.
+
+        Args:
+            temp_path (str): The path of the file while it is recorded.
+            destination (str): The path the file is moved to when it is closed, without extension.
+            header (list): The header row, binary files have their own header.
+        """
+        if self.file is not None:
+            self.close()
+        os.makedirs(os.path.dirname(temp_path), exist_ok=True)
+        runs = self.encoder is not None
+        if self.file_format == "binary":
+            self.file = open(temp_path, 'ab')
+            self.writer = BinarySampleWriter(self.file, runs)
+            if self.file.tell() == 0:
+                self.file.write(get_binary_header(runs))
+        else:
+            self.file = open(temp_path, 'a', newline='')
+            self.writer = csv.writer(self.file)
+        self.temp_path = temp_path
+        self.destination = destination + self.extension
+        if runs:
+            header = list(header) + [RUN_HEADER]
+        self.rows = [header] if self.file_format == "csv" and self.file.tell() == 0 else []
+        self.samples = 0
+
+    def append(self, row):
+        """
+        Add a row to the buffer, it is written on the next flush.
+
+        Args:
+            row (list): The row to write.
+        """
+        self.samples += 1
+        if self.encoder is not None:
+            # only the runs ended by the sample are written
+            row = self.encoder.add(row)
+            if row is None:
+                return
+        self.rows.append(row)
+
+    def flush(self):
+        """
+        Write the buffered rows to the file and record the size of the file in the journal.
+        """
+        if self.file is None or len(self.rows) == 0:
+            return
+        self.writer.writerows(self.rows)
+        self.rows = []
+        self.file.flush()
+        sync = self.fsync_policy == "flush"
+        if sync:
+            os.fsync(self.file.fileno())
+        write_journal(self.journal_path, {"file": self.temp_path, "destination": self.destination, "size": self.file.tell()}, sync)
+
+    def close(self):
+        """
+        Flush the remaining rows, close the file and move it to the data folder. A file without any sample is removed instead.
+
+        Returns:
+            str: The path the file was moved to, None if no file was open or the file was removed.
+        """
+        if self.file is None:
+            return None
+        if self.samples == 0 and (self.file.tell() == 0 or self.file_format == "binary"):
+            self.file.close()
+            self.file = None
+            self.writer = None
+            os.remove(self.temp_path)
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            return None
+        if self.encoder is not None:
+            # the current run ends with the file
+            run = self.encoder.close()
+            if run is not None:
+                self.rows.append(run)
+        self.flush()
+        if self.fsync_policy != "never":
+            os.fsync(self.file.fileno())
+        self.file.close()
+        self.file = None
+        self.writer = None
+        destination = move_file(self.temp_path, self.destination)
+        # the file is in the data folder, the journal has nothing left to recover
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        if self.fsync_policy != "never":
+            fsync_directory(os.path.dirname(destination))
+            fsync_directory(os.path.dirname(self.temp_path))
+        return destination
+
+
+def compress_file(path, level=GZIP_LEVEL):
+    """
+    Gzip a closed file and remove it. The compressed file is written under a temporary name and renamed once complete,
+    so a power loss leaves either the file or its compressed copy.
+
+    Args:
+        path (str): The path of the file.
+        level (int): The gzip compression level, from 1 (fastest) to 9 (smallest).
+
+    Returns:
+        str: The path of the compressed file.
+    """
+    compressedPath = path + ".gz"
+    tempPath = compressedPath + ".tmp"
+    with open(path, 'rb') as source, open(tempPath, 'wb') as f:
+        # no file name or time in the gzip header, the same file always compresses to the same bytes
+        with gzip.GzipFile(filename='', mode='wb', compresslevel=level, fileobj=f, mtime=0) as compressed:
+            shutil.copyfileobj(source, compressed)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tempPath, compressedPath)
+    os.remove(path)
+    fsync_directory(os.path.dirname(path) or ".")
+    return compressedPath
+
+def compress_data_files(data_dir, level=GZIP_LEVEL):
+    """
+    Gzip the closed files of the data folder that are not compressed yet. The file being recorded is in the temp folder and is left alone.
+
+    Args:
+        data_dir (str): The data folder.
+        level (int): The gzip compression level.
+
+    Returns:
+        list: The paths of the compressed files.
+    """
+    compressed = []
+    for path, subdirs, files in os.walk(data_dir):
+        for name in sorted(files):
+            if name.endswith(UNCOMPRESSED_EXTENSIONS):
+                try:
+                    compressed.append(compress_file(os.path.join(path, name), level))
+                except OSError as e:
+                    print(f"Could not compress {name}: {e}")
+    return compressed
+
+
+def truncate_to_last_row(path, size=None, record_size=None):
+    """
+    Cut a file back to its last complete row, and to size bytes first if given.
+
+    Args:
+        path (str): The path of the file.
+        size (int): The number of bytes known to be complete, None to keep the whole file.
+        record_size (int): The size of the records of a binary file, None for a CSV file.
+
+    Returns:
+        int: The new size of the file.
+    """
+    with open(path, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        fileSize = f.tell()
+        if size is not None and size < fileSize:
+            fileSize = size
+        end = fileSize
+        if record_size is not None:
+            # the records have a fixed size after the header
+            end = BINARY_HEADER.size + max(0, end - BINARY_HEADER.size) // record_size * record_size
+        # look back for the end of the last complete row
+        while record_size is None and end > 0:
+            start = max(0, end - 1024)
+            f.seek(start)
+            chunk = f.read(end - start)
+            newline = chunk.rfind(b"\n")
+            if newline >= 0:
+                end = start + newline + 1
+                break
+            end = start
+        f.truncate(end)
+        f.flush()
+        os.fsync(f.fileno())
+    return end
+
+def recover_temp_files(temp_dir, data_dir):
+    """
+    Move the files left in the temp folder by a power loss or a crash to the data folder.
+    The file named in the journal is cut back to the size recorded at its last flush, the rows written after it may be incomplete.
+    Every file is cut back to its last complete row, and files without any sample are removed.
+
+    Args:
+        temp_dir (str): The temp folder.
+        data_dir (str): The data folder, files are moved to data_dir/<ID>/<yymmdd>/.
+
+    Returns:
+        list: The paths the files were moved to.
+    """
+    journalPath = os.path.join(temp_dir, JOURNAL_FILE)
+    journal = read_journal(journalPath)
+    moved = []
+    for name in sorted(os.listdir(temp_dir)):
+        path = os.path.join(temp_dir, name)
+        if not os.path.isfile(path) or name.startswith(JOURNAL_FILE):
+            continue
+        recordSize = get_binary_record_size(path)
+        binary = recordSize is not None
+        if binary:
+            headerSize = BINARY_HEADER.size
+        else:
+            # the header is the first line, with the 'Samples' column in a file of runs
+            with open(path, 'rb') as f:
+                headerSize = len(f.readline())
+        size = None
+        destination = None
+        if journal is not None and os.path.abspath(journal.get("file", "")) == os.path.abspath(path):
+            size = journal.get("size")
+            destination = journal.get("destination")
+        if destination is None:
+            # temp files are named <DEVICE>_<ID>_<yymmdd>_<HHMMSS>
+            parts = name.split('_')
+            if len(parts) < 4:
+                print(f"Unexpected file {name} left in the temp folder")
+                continue
+            destination = os.path.join(data_dir, parts[1], parts[2], name + FILE_FORMATS["binary" if binary else "csv"])
+        if truncate_to_last_row(path, size, recordSize) <= headerSize:
+            # nothing but the header was written
+            os.remove(path)
+            continue
+        moved.append(move_file(path, destination))
+        print(f"File {name} moved to {moved[-1]}")
+    if os.path.exists(journalPath):
+        os.remove(journalPath)
+    return moved
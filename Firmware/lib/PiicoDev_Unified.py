@@ -16,8 +16,13 @@ if _SYSNAME == 'microbit':
     
 elif _SYSNAME == 'Linux':
     from smbus2 import SMBus, i2c_msg
+    from ctypes import c_char, POINTER, cast
     from time import sleep
     from math import ceil
+    import threading
+
+    # flag of the read messages of an I2C_RDWR transaction (linux/i2c.h)
+    I2C_M_RD = 0x0001
     
     def sleep_ms(t):
         sleep(t/1000)
@@ -88,7 +93,24 @@ class I2CUnifiedMicroBit(I2CBase):
         i2c.write(addr, reg, repeat=True)
         return i2c.read(addr, 2)
             
+class I2CStats:
+    """Transaction counters of a device on an I2C bus"""
+    def __init__(self):
+        self.transactions = 0
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.errors = 0
+
+    def as_dict(self):
+        return {'transactions': self.transactions, 'bytes_written': self.bytes_written, 'bytes_read': self.bytes_read, 'errors': self.errors}
+
 class I2CUnifiedLinux(I2CBase):
+    """I2C transport of a Linux bus, shared by the drivers of the devices on the bus (see get_i2c_transport)
+
+    The register accesses are single I2C_RDWR transactions built from i2c_msg, the data read is returned as bytes
+    (or read into the caller's buffer with readfrom_mem_into) without going through a list of ints.
+    The transactions, bytes and errors are counted per device address, get_stats() returns the counters.
+    """
     def __init__(self, bus=None, suppress_warnings=True):
         if suppress_warnings == False:
             with open('/boot/config.txt') as config_file:
@@ -105,63 +127,140 @@ class I2CUnifiedLinux(I2CBase):
                 config_file.close()
         if bus is None:
             bus = 0
+        self.bus = bus
         self.i2c = SMBus(bus)
+        self.stats = {}
+        self._statsLock = threading.Lock()
 
-    def readfrom_mem(self, addr, memaddr, nbytes, *, addrsize=8):
-        data = [None] * nbytes # initialise empty list
-        self.smbus_i2c_read(addr, memaddr, data, nbytes, addrsize=addrsize)
-        return data
-    
-    def writeto_mem(self, addr, memaddr, buf, *, addrsize=8):
-        self.smbus_i2c_write(addr, memaddr, buf, len(buf), addrsize=addrsize)
-    
-    def smbus_i2c_write(self, address, reg, data_p, length, addrsize=8):
-        ret_val = 0
-        data = []
-        for index in range(length):
-            data.append(data_p[index])
-        if addrsize == 8:
-            msg_w = i2c_msg.write(address, [reg] + data)
-        elif addrsize == 16:
-            msg_w = i2c_msg.write(address, [reg >> 8, reg & 0xff] + data)
-        else:
-            raise Exception('address must be 8 or 16 bits long only')
-        self.i2c.i2c_rdwr(msg_w)
-        return ret_val
-        
-    def smbus_i2c_read(self, address, reg, data_p, length, addrsize=8):
-        ret_val = 0
+    def _count(self, address, written, read, error=False):
+        with self._statsLock:
+            stats = self.stats.get(address)
+            if stats is None:
+                stats = self.stats[address] = I2CStats()
+            stats.transactions += 1
+            if error:
+                stats.errors += 1
+            else:
+                stats.bytes_written += written
+                stats.bytes_read += read
+
+    def _transfer(self, address, messages, written, read):
+        # a single ioctl, the messages are separated by repeated starts
+        try:
+            self.i2c.i2c_rdwr(*messages)
+        except OSError:
+            self._count(address, written, read, error=True)
+            raise
+        self._count(address, written, read)
+
+    def _register_address(self, memaddr, addrsize):
         if addrsize == 8:
-            msg_w = i2c_msg.write(address, [reg]) # warning this is set up for 16-bit addresses
+            return bytes([memaddr])
         elif addrsize == 16:
-            msg_w = i2c_msg.write(address, [reg >> 8, reg & 0xff]) # warning this is set up for 16-bit addresses
+            return bytes([memaddr >> 8, memaddr & 0xff])
         else:
             raise Exception('address must be 8 or 16 bits long only')
-        msg_r = i2c_msg.read(address, length)
-        self.i2c.i2c_rdwr(msg_w, msg_r)
-        if ret_val == 0:
-            for index in range(length):
-                data_p[index] = ord(msg_r.buf[index])
-        return ret_val
-    
+
+    def get_stats(self):
+        """Return a copy of the counters, {device address: {'transactions', 'bytes_written', 'bytes_read', 'errors'}}"""
+        with self._statsLock:
+            return {address: stats.as_dict() for address, stats in self.stats.items()}
+
+    def reset_stats(self):
+        with self._statsLock:
+            self.stats = {}
+
+    def readfrom_mem(self, addr, memaddr, nbytes, *, addrsize=8):
+        register = self._register_address(memaddr, addrsize)
+        msg_r = i2c_msg.read(addr, nbytes)
+        self._transfer(addr, (i2c_msg.write(addr, register), msg_r), len(register), nbytes)
+        return bytes(msg_r)
+
+    def readfrom_mem_into(self, addr, memaddr, buf, *, addrsize=8):
+        """Read len(buf) bytes from memaddr into buf (a bytearray or a writable memoryview), the I2C driver writes them in place"""
+        register = self._register_address(memaddr, addrsize)
+        nbytes = len(buf)
+        target = cast((c_char * nbytes).from_buffer(buf), POINTER(c_char))
+        msg_r = i2c_msg(addr=addr, flags=I2C_M_RD, len=nbytes, buf=target)
+        self._transfer(addr, (i2c_msg.write(addr, register), msg_r), len(register), nbytes)
+
+    def readfrom_mem_blocks(self, addr, blocks, *, addrsize=8):
+        """Read several blocks of registers in a single transaction
+
+        Args:
+            addr (int): The address of the device.
+            blocks (list): The (memaddr, nbytes) of the blocks.
+
+        Returns:
+            list: The bytes of each block.
+        """
+        messages = []
+        reads = []
+        written = 0
+        for memaddr, nbytes in blocks:
+            register = self._register_address(memaddr, addrsize)
+            msg_r = i2c_msg.read(addr, nbytes)
+            messages += [i2c_msg.write(addr, register), msg_r]
+            reads.append(msg_r)
+            written += len(register)
+        self._transfer(addr, messages, written, sum(nbytes for memaddr, nbytes in blocks))
+        return [bytes(msg_r) for msg_r in reads]
+
+    def readfrom(self, addr, nbytes):
+        msg_r = i2c_msg.read(addr, nbytes)
+        self._transfer(addr, (msg_r,), 0, nbytes)
+        return bytes(msg_r)
+
+    def writeto_mem(self, addr, memaddr, buf, *, addrsize=8):
+        data = self._register_address(memaddr, addrsize) + bytes(buf)
+        self._transfer(addr, (i2c_msg.write(addr, data),), len(data), 0)
+
     def write8(self, addr, reg, data):
-        if reg is None:
-            d = int.from_bytes(data, 'big')
-            self.i2c.write_byte(addr, d)
-        else:
-            r = int.from_bytes(reg, 'big')
-            d = int.from_bytes(data, 'big')
-            self.i2c.write_byte_data(addr, r, d)
+        try:
+            if reg is None:
+                d = int.from_bytes(data, 'big')
+                self.i2c.write_byte(addr, d)
+            else:
+                r = int.from_bytes(reg, 'big')
+                d = int.from_bytes(data, 'big')
+                self.i2c.write_byte_data(addr, r, d)
+        except OSError:
+            self._count(addr, 0, 0, error=True)
+            raise
+        self._count(addr, 1 if reg is None else 2, 0)
     
     def read16(self, addr, reg):
         regInt = int.from_bytes(reg, 'big')
-        return self.i2c.read_word_data(addr, regInt).to_bytes(2, byteorder='little', signed=False)
+        try:
+            word = self.i2c.read_word_data(addr, regInt)
+        except OSError:
+            self._count(addr, 0, 0, error=True)
+            raise
+        self._count(addr, 1, 2)
+        return word.to_bytes(2, byteorder='little', signed=False)
+
+# one transport per Linux bus, shared by all the drivers so that the counters cover every device
+_linuxTransports = {}
+_linuxTransportsLock = threading.Lock() if _SYSNAME == 'Linux' else None
+
+def get_i2c_transport(bus=None, suppress_warnings=True):
+    """Return the shared transport of a Linux I2C bus, created on the first call"""
+    if bus is None:
+        bus = 0
+    with _linuxTransportsLock:
+        if bus not in _linuxTransports:
+            _linuxTransports[bus] = I2CUnifiedLinux(bus=bus, suppress_warnings=suppress_warnings)
+        return _linuxTransports[bus]
+
+def get_i2c_stats():
+    """Return the counters of every device of the shared transports, {bus: {device address: counters}}"""
+    return {bus: transport.get_stats() for bus, transport in _linuxTransports.items()}
 
 def create_unified_i2c(bus=None, freq=None, sda=None, scl=None, suppress_warnings=True):
     if _SYSNAME == 'microbit':
         i2c = I2CUnifiedMicroBit(freq=freq)
     elif _SYSNAME == 'Linux':
-        i2c = I2CUnifiedLinux(bus=bus, suppress_warnings=suppress_warnings)
+        i2c = get_i2c_transport(bus=bus, suppress_warnings=suppress_warnings)
     else:
         i2c = I2CUnifiedMachine(bus=bus, freq=freq, sda=sda, scl=scl)
     return i2c
\ No newline at end of file
@@ -96,6 +96,12 @@ VL51L1X_DEFAULT_CONFIGURATION = bytes([
 0x40  # 0x87 : start ranging, use StartRanging() or StopRanging(), If you want an automatic start after VL53L1X_init() call, put 0x40 in location 0x87 */
 ])
 
+# RESULT__RANGE_STATUS value of a valid range, the other values are failures (see the status list in read())
+RANGE_STATUS_VALID = 9
+# time to wait for a measurement of the continuous ranging before giving up on a burst
+DATA_READY_TIMEOUT_MS = 250
+DATA_READY_POLL_MS = 5
+
 
 class PiicoDev_VL53L1X:
     def __init__(self, bus=None, freq=None, sda=None, scl=None, address=0x29):
@@ -119,6 +125,8 @@ class PiicoDev_VL53L1X:
         # measurement is started; assumes MM1 and MM2 are disabled
         self.writeReg16Bit(0x001E, self.readReg16Bit(0x0022) * 4)
         sleep_ms(200)
+        # GPIO_HV_MUX__CTRL bit 4 is 0 for an active high interrupt, the data ready bit then reads 1
+        self.interruptPolarity = 0 if self.readReg(0x0030) & 0x10 else 1
 
     def writeReg(self, reg, value):
         return self.i2c.writeto_mem(self.addr, reg, bytes([value]), addrsize=16)
@@ -176,6 +184,77 @@ class PiicoDev_VL53L1X:
             #else:
                 #status = "OK"
         return final_crosstalk_corrected_range_mm_sd0
+
+    def start_ranging(self):
+        self.writeReg(0x0087, 0x40) # SYSTEM__MODE_START, continuous ranging (started by the default configuration)
+    def stop_ranging(self):
+        self.writeReg(0x0087, 0x00)
+    def clear_interrupt(self):
+        self.writeReg(0x0086, 0x01) # SYSTEM__INTERRUPT_CLEAR, the sensor starts the next measurement
+    def data_ready(self):
+        return (self.readReg(0x0031) & 0x01) == self.interruptPolarity # GPIO__TIO_HV_STATUS
+
+    def wait_data_ready(self, timeout_ms=DATA_READY_TIMEOUT_MS):
+        """
+        Wait for the continuous ranging to complete a measurement.
+
+        Args:
+            timeout_ms (int): The maximum time to wait in milliseconds.
+
+        Returns:
+            bool: True if a measurement is ready, False if the timeout expired.
+        """
+        for i in range(max(1, timeout_ms // DATA_READY_POLL_MS)):
+            if self.data_ready():
+                return True
+            sleep_ms(DATA_READY_POLL_MS)
+        return self.data_ready()
+
+    def read_burst(self, count=5, timeout_ms=DATA_READY_TIMEOUT_MS):
+        """
+        Read a burst of measurements from the continuous ranging and reduce them to their median.
+
+        Each measurement is read once the sensor reports it ready, only the range status (1 byte)
+        and the range (2 bytes) are read instead of the 17 bytes of read(), in a single transaction
+        where the I2C transport supports block reads. The measurements whose
+        status is not a valid range are left out.
+
+        Args:
+            count (int): The number of measurements of the burst.
+            timeout_ms (int): The maximum time to wait for each measurement in milliseconds.
+
+        Returns:
+            tuple: The median distance in mm and the spread (largest minus smallest valid distance) in mm,
+                   both NaN if the burst holds no valid range.
+        """
+        distances = []
+        try:
+            # the result held by the sensor may be from long ago, clear it and take the measurements that follow
+            self.clear_interrupt()
+            for i in range(count):
+                if not self.wait_data_ready(timeout_ms):
+                    break
+                # RESULT__RANGE_STATUS and RESULT__FINAL_CROSSTALK_CORRECTED_RANGE_MM_SD0
+                if hasattr(self.i2c, 'readfrom_mem_blocks'):
+                    status, data = self.i2c.readfrom_mem_blocks(self.addr, [(0x0089, 1), (0x0096, 2)], addrsize=16)
+                else:
+                    status, data = self.i2c.readfrom_mem(self.addr, 0x0089, 1, addrsize=16), self.i2c.readfrom_mem(self.addr, 0x0096, 2, addrsize=16)
+                range_status = status[0] & 0x1F
+                distance = (data[0]<<8) + data[1]
+                self.clear_interrupt()
+                if range_status == RANGE_STATUS_VALID:
+                    distances.append(distance)
+        except:
+            print(i2c_err_str.format(self.addr))
+        if len(distances) == 0:
+            return float('NaN'), float('NaN')
+        distances.sort()
+        middle = len(distances) // 2
+        if len(distances) % 2:
+            median = distances[middle]
+        else:
+            median = (distances[middle - 1] + distances[middle]) / 2
+        return median, distances[-1] - distances[0]
     
     def change_addr(self, new_addr):
         self.writeReg(0x0001, new_addr & 0x7F)
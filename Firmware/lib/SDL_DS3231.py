@@ -33,10 +33,11 @@
 
 from __future__ import print_function
 
-from datetime import datetime
+from datetime import datetime, timedelta
+import threading
 import time
 
-import smbus2
+from lib.PiicoDev_Unified import get_i2c_transport
 
 
 SECONDS_PER_MINUTE = 60
@@ -49,6 +50,11 @@ YEARS_PER_CENTURY = 100
 
 OSCILLATOR_ON_MASK = 0b1<<7
 
+# seconds between two reads of the DS3231 by CachedDS3231, the time in between comes from the monotonic clock
+RESYNC_PERIOD = 600
+# longest step back of the cached time at a resync that is hidden, larger steps are real changes of the time
+MAX_HIDDEN_STEP = 1.0
+
 def bcd_to_int(bcd, n=2):
     """Decode n least significant packed binary coded decimal digits to binary.
     Return binary result.
@@ -85,7 +91,8 @@ class SDL_DS3231():
     # datasheet: https://datasheets.maximintegrated.com/en/ds/DS3231.pdf
     ###########################
     def __init__(self, twi=0, addr=0x68, at24c32_addr=0x56):
-        self._bus = smbus2.SMBus(twi)
+        # the transport shared with the other devices of the bus, it counts the transactions (see PiicoDev_Unified.py)
+        self._bus = get_i2c_transport(twi)
         self._addr = addr
         self._at24c32_addr = at24c32_addr
 
@@ -94,10 +101,10 @@ class SDL_DS3231():
             print(
                 "addr =0x%x register = 0x%x data = 0x%x %i " %
                 (self._addr, register, data, bcd_to_int(data)))
-        self._bus.write_byte_data(self._addr, register, data)
+        self._bus.writeto_mem(self._addr, register, bytes([data]))
 
     def _read(self, register_address):
-        data = self._bus.read_byte_data(self._addr, register_address)
+        data = self._bus.readfrom_mem(self._addr, register_address, 1)[0]
         if False:
             print(
                 "addr = 0x%x register_address = 0x%x %i data = 0x%x %i "
@@ -120,10 +127,15 @@ class SDL_DS3231():
             self._REG_MONTH,
             self._REG_YEAR,
         )
-        seconds, minutes, hours, day, date, month, year = (
+        return self._decode(tuple(
             self._read(register_address)
             for register_address in register_addresses
-        )
+        ))
+
+    def _decode(self, registers):
+        """Return tuple of year, month, date, day, hours, minutes, seconds
+        from the raw seconds to year registers."""
+        seconds, minutes, hours, day, date, month, year = registers
         seconds &= ~OSCILLATOR_ON_MASK
         if True:
             # This stuff is suspicious.
@@ -138,16 +150,11 @@ class SDL_DS3231():
         """Return tuple of year, month, date, day, hours, minutes, seconds.
         """
 
-        """Read until one gets same result twice in a row.
-        Then one knows the time is coherent."""
+        """Read the seven time registers in a single block read.
+        The DS3231 copies the time registers to a buffer at the start of
+        an I2C read, so the registers of one block read are coherent."""
 
-        old = self._incoherent_read_all()
-        while True:
-            new = self._incoherent_read_all()
-            if old == new:
-                break
-            old = new
-        return new
+        return self._decode(self._bus.readfrom_mem(self._addr, self._REG_SECONDS, 7))
 
     def read_str(self):
         """Return a string such as 'YY-DD-MMTHH-MM-SS'.
@@ -221,9 +228,15 @@ class SDL_DS3231():
         """
         self.write_datetime(datetime.now())
 
+    def read_seconds(self):
+        """Return the seconds register only, one single byte read.
+        """
+        return bcd_to_int(self._read(self._REG_SECONDS) & ~OSCILLATOR_ON_MASK)
+
     def getTemp(self):
-        byte_tmsb = self._bus.read_byte_data(self._addr,0x11)
-        byte_tlsb = bin(self._bus.read_byte_data(self._addr,0x12))[2:].zfill(8)
+        # both temperature registers in one read
+        byte_tmsb, byte_tlsb = self._bus.readfrom_mem(self._addr, 0x11, 2)
+        byte_tlsb = bin(byte_tlsb)[2:].zfill(8)
         return byte_tmsb+int(byte_tlsb[0])*2**(-1)+int(byte_tlsb[1])*2**(-2)
 
     ###########################
@@ -232,8 +245,7 @@ class SDL_DS3231():
     ###########################
 
     def set_current_AT24C32_address(self,address):
-        a1, a0 = divmod(address, 1<<8)
-        self._bus.write_i2c_block_data(self._at24c32_addr,a1,[a0])
+        self._bus.writeto_mem(self._at24c32_addr, address, b'', addrsize=16)
 
     def read_AT24C32_byte(self, address):
         if False:
@@ -242,13 +254,103 @@ class SDL_DS3231():
                 (self._at24c32_addr, address))
 
         self.set_current_AT24C32_address(address)
-        return self._bus.read_byte(self._at24c32_addr)
+        return self._bus.readfrom(self._at24c32_addr, 1)[0]
 
     def write_AT24C32_byte(self, address, value):
         if False:
             print(
                 "i2c_address =0x%x eepromaddress = 0x%x value = 0x%x %i " %
                 (self._at24c32_addr, address, value, value))
-        a1, a0 = divmod(address, 1<<8)
-        self._bus.write_i2c_block_data(self._at24c32_addr,a1,[a0, value])
-        time.sleep(0.20)
\ No newline at end of file
+        self._bus.writeto_mem(self._at24c32_addr, address, bytes([value]), addrsize=16)
+        time.sleep(0.20)
+
+
+class CachedDS3231(SDL_DS3231):
+    """DS3231 read once every RESYNC_PERIOD seconds.
+
+    The time read from the DS3231 is anchored to time.monotonic() at the
+    tick of its seconds register, read_datetime then adds the monotonic time
+    elapsed since the anchor without any I2C transaction. The datetimes have
+    sub-second resolution. Safe to share between threads.
+
+    Waiting for the tick takes up to a second, the periodic resyncs run in a
+    background thread while the readers keep using the previous anchor, and
+    the new anchor is swapped in under the lock. Only the first read waits.
+    """
+
+    def __init__(self, twi=0, addr=0x68, at24c32_addr=0x56, resync_period=RESYNC_PERIOD):
+        super().__init__(twi, addr, at24c32_addr)
+        self._resync_period = resync_period
+        self._lock = threading.Lock()
+        self._anchor = None
+        self._anchor_monotonic = None
+        self._last = None
+        self._resyncing = False
+        # incremented by write_datetime, a resync started before a write is discarded
+        self._generation = 0
+
+    def _wait_for_tick(self, timeout=1.5):
+        """Poll the seconds register until it changes, so that the anchor is
+        taken at the start of a second. Return the monotonic time of the tick,
+        None if no tick was seen before the timeout."""
+        start = time.monotonic()
+        seconds = self.read_seconds()
+        while time.monotonic() - start < timeout:
+            time.sleep(0.01)
+            if self.read_seconds() != seconds:
+                return time.monotonic()
+        return None
+
+    def resync(self):
+        """Read the DS3231 and anchor the monotonic clock to it, the readers
+        are not blocked while waiting for the tick.
+        """
+        with self._lock:
+            generation = self._generation
+        try:
+            tick = self._wait_for_tick()
+            # the block read right after the tick returns the second that just started
+            anchor = SDL_DS3231.read_datetime(self)
+            anchor_monotonic = tick if tick is not None else time.monotonic()
+        except OSError:
+            # keep the previous anchor, the next read retries
+            with self._lock:
+                self._resyncing = False
+            if self._anchor is None:
+                raise
+            return
+        with self._lock:
+            if generation == self._generation:
+                self._anchor = anchor
+                self._anchor_monotonic = anchor_monotonic
+            self._resyncing = False
+
+    def read_datetime(self, century=21, tzinfo=None):
+        """Return the datetime.datetime object, from the monotonic clock.
+        """
+        if self._anchor is None:
+            self.resync()
+        with self._lock:
+            if not self._resyncing and time.monotonic() - self._anchor_monotonic >= self._resync_period:
+                self._resyncing = True
+                threading.Thread(target=self.resync, daemon=True).start()
+            now = self._anchor + timedelta(seconds=time.monotonic() - self._anchor_monotonic)
+            # the monotonic clock and the DS3231 drift apart slightly between
+            # two resyncs, never go back in time by such a small step
+            if self._last is not None and timedelta(0) < self._last - now < timedelta(seconds=MAX_HIDDEN_STEP):
+                now = self._last
+            self._last = now
+        if tzinfo is not None:
+            now = now.replace(tzinfo=tzinfo)
+        return now
+
+    def write_datetime(self, dt):
+        """Write from a datetime.datetime object and anchor the monotonic clock to it.
+        """
+        with self._lock:
+            SDL_DS3231.write_datetime(self, dt)
+            self._generation += 1
+            # writing the seconds register restarts the second of the DS3231
+            self._anchor = dt.replace(microsecond=0, tzinfo=None)
+            self._anchor_monotonic = time.monotonic()
+            self._last = None
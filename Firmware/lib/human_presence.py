@@ -5,6 +5,9 @@ Author: Sami Kaab
 Date: 2023-07-05
 """
 
+import select
+import threading
+from collections import deque
 import lib.onionGpio as onionGpio
 from lib.DFRobot_mmWave import *
 
@@ -30,15 +33,82 @@ def init_hdp():
     """Function to initialise the HPD GPIO pin
     """
     setup_hpd(0,0,0,1)
-    gpioObject  = onionGpio.OnionGpio(HPD_GPIO_PIN)
+    gpioObject  = onionGpio.PersistentGpio(HPD_GPIO_PIN)
     status  = gpioObject.setInputDirection()
     
 def read_presence():
-    """Function to read the HPD GPIO pin
+    """Function to read the HPD GPIO pin, the pin stays exported and its value file open between the reads
     """
-    gpioObject  = onionGpio.OnionGpio(HPD_GPIO_PIN)
+    gpioObject  = onionGpio.PersistentGpio(HPD_GPIO_PIN)
     return int(gpioObject.getValue())
 
+class PresenceWatcher(threading.Thread):
+    """Thread timestamping every change of the HPD GPIO pin.
+
+    The sysfs edge file of the pin is set to both so that a poll of its value file returns on every rising and falling edge,
+    the thread sleeps in select.poll in between. The changes are queued with their time until they are taken with pop_events,
+    and value always holds the current presence without reading the pin.
+    """
+
+    def __init__(self, clock, pin=HPD_GPIO_PIN, maxEvents=1000):
+        """
+        Args:
+            clock: The clock timestamping the edges, with a read_datetime method (e.g. the RTC).
+            pin (int): The GPIO pin of the HPD sensor.
+            maxEvents (int): The largest number of changes kept until they are taken, the oldest are dropped beyond.
+        """
+        super().__init__(daemon=True)
+        self.clock = clock
+        self.pin = pin
+        self.events = deque(maxlen=maxEvents)
+        self.value = None
+        # set when the pin could not be set up for edges, the presence must then be read with read_presence
+        self.failed = threading.Event()
+        self.ready = threading.Event()
+
+    def run(self):
+        try:
+            gpio = onionGpio.PersistentGpio(self.pin)
+            gpio.setInputDirection()
+            if gpio.setEdge("both") != 0:
+                raise OSError(f"cannot set the edge of GPIO {self.pin}")
+            poller = select.poll()
+            poller.register(gpio.getValueFd(), select.POLLPRI | select.POLLERR)
+            # reading the value clears the pending edge
+            self.value = int(gpio.getValue())
+        except Exception as e:
+            print(f"presence watcher: {e}, the presence is read at every sample")
+            self.failed.set()
+            self.ready.set()
+            return
+        self.ready.set()
+        # the thread lives as long as the firmware, it only wakes up at the edges
+        while True:
+            if not poller.poll():
+                continue
+            eventTime = self.clock.read_datetime()
+            value = int(gpio.getValue())
+            # a short pulse can end before the value is read, it is then not a change
+            if value != self.value:
+                self.value = value
+                self.events.append((eventTime, value))
+
+    def available(self):
+        """Return True if the presence is watched, False if it must be read with read_presence."""
+        self.ready.wait()
+        return not self.failed.is_set()
+
+    def pop_events(self):
+        """Take the changes of presence since the last call.
+
+        Returns:
+            list: The (datetime, presence) of each change, in time order.
+        """
+        events = []
+        while self.events:
+            events.append(self.events.popleft())
+        return events
+
 if __name__ == "__main__":
     init_hdp()
     while True:
@@ -1,4 +1,6 @@
+import os
 import sys
+import threading
 
 
 __version__ = "0.1"
@@ -16,12 +18,15 @@ GPIO_PATH 						= GPIO_BASE_PATH + '/gpio%d'
 GPIO_VALUE_FILE					= 'value'
 GPIO_DIRECTION_FILE				= 'direction'
 GPIO_ACTIVE_LOW_FILE			= 'active_low'
+GPIO_EDGE_FILE					= 'edge'
 
 _GPIO_INPUT_DIRECTION			= 'in'
 _GPIO_OUTPUT_DIRECTION			= 'out'
 _GPIO_OUTPUT_DIRECTION_LOW		= 'low'
 _GPIO_OUTPUT_DIRECTION_HIGH		= 'high'
 
+_GPIO_EDGES					= ('none', 'rising', 'falling', 'both')
+
 _GPIO_ACTIVE_HIGH				= 0
 _GPIO_ACTIVE_LOW				= 1
 
@@ -221,3 +226,96 @@ class OnionGpio:
 		return 	ret
 
 
+class PersistentGpio(OnionGpio):
+	"""sysfs GPIO access keeping the GPIO exported and its value file open.
+
+	Drop-in replacement for OnionGpio: same methods and return values, but the
+	GPIO is exported once and the value file is read with os.pread on a file
+	descriptor kept open, one system call per read instead of an export, an
+	open, a read, a close and an unexport. Constructing PersistentGpio again for
+	the same GPIO returns the same object, so call sites that create a new
+	OnionGpio for every read keep a single open file descriptor.
+	"""
+
+	_instances 		= {}
+	_instancesLock 	= threading.Lock()
+
+	def __new__(cls, gpio, verbose=0):
+		with cls._instancesLock:
+			if gpio not in cls._instances:
+				instance 	= super().__new__(cls)
+				instance.valueFd 	= None
+				instance.lock 		= threading.Lock()
+				cls._instances[gpio] = instance
+			return cls._instances[gpio]
+
+	def _initGpio(self):
+		"""Export the gpio if it is not exported yet"""
+		if not os.path.isdir(self.path):
+			with open(GPIO_EXPORT, 'w') as fd:
+				fd.write(str(self.gpio))
+		return _EXIT_SUCCESS
+
+	def _freeGpio(self):
+		"""The gpio stays exported, see close"""
+		return _EXIT_SUCCESS
+
+	def _openValue(self):
+		"""Open the value file, exporting the gpio first if needed"""
+		if self.valueFd is None:
+			self._initGpio()
+			self.valueFd 	= os.open(self.path + "/" + GPIO_VALUE_FILE, os.O_RDWR)
+		return self.valueFd
+
+	def _closeValue(self):
+		if self.valueFd is not None:
+			try:
+				os.close(self.valueFd)
+			except OSError:
+				pass
+			self.valueFd 	= None
+
+	def getValue(self):
+		"""Read current GPIO value"""
+		with self.lock:
+			try:
+				return os.pread(self._openValue(), 16, 0).decode()
+			except OSError:
+				# the gpio was unexported by another program, export it and open the value file again
+				self._closeValue()
+				return os.pread(self._openValue(), 16, 0).decode()
+
+	def setValue(self, value):
+		"""Set the desired GPIO value"""
+		with self.lock:
+			try:
+				os.pwrite(self._openValue(), str(value).encode(), 0)
+			except OSError:
+				self._closeValue()
+				os.pwrite(self._openValue(), str(value).encode(), 0)
+		return _EXIT_SUCCESS
+
+	def getValueFd(self):
+		"""Return the file descriptor of the value file, to wait for an edge with select.poll"""
+		with self.lock:
+			return self._openValue()
+
+	def setEdge(self, edge):
+		"""Set the edges that wake up a poll of the value file: 'none', 'rising', 'falling' or 'both'"""
+		if edge not in _GPIO_EDGES:
+			return _EXIT_FAILURE
+		with self.lock:
+			self._initGpio()
+			with open(self.path + "/" + GPIO_EDGE_FILE, 'w') as fd:
+				fd.write(edge)
+		return _EXIT_SUCCESS
+
+	def close(self):
+		"""Close the value file and unexport the gpio"""
+		with self.lock:
+			self._closeValue()
+			if os.path.isdir(self.path):
+				with open(GPIO_UNEXPORT, 'w') as fd:
+					fd.write(str(self.gpio))
+		with PersistentGpio._instancesLock:
+			PersistentGpio._instances.pop(self.gpio, None)
@@ -25,7 +25,8 @@ import lib.SDL_DS3231 as RTC
 import backup_to_drive as google_drive
 from lib.battery import compute_battery_level
 
-from shared_resources import stop_event, CONFIG_FILE, TEMP_DIR, DEVICE_ID, DATA_DIR
+from shared_resources import stop_event, CONFIG_FILE, TEMP_DIR, DEVICE_ID, DATA_DIR, ROOT_DIR
+from data_writer import recover_temp_files
 from sensor_thread import read_write_loop
 from upload_thread import upload_loop
 from led_thread import pulsate_led
@@ -35,6 +36,7 @@ status_queue = deque(maxlen=10)
 sensor_datetime = []
 sensor_presence = []
 sensor_distance = []
+sensor_spread = []
 
 
 def internet_check_loop(led_status_queue):
@@ -159,14 +161,16 @@ def update_data():
             sensor_datetime.append(datetime_str)
             sensor_distance.append(sensor_data[1])
             sensor_presence.append(sensor_data[2])
+            sensor_spread.append(sensor_data[4])
             if len(sensor_datetime) > 10:
                 sensor_datetime.pop(0)
                 sensor_distance.pop(0)
                 sensor_presence.pop(0)
+                sensor_spread.pop(0)
                 
             
 
-        return jsonify({'datetime': sensor_datetime, 'distance': sensor_distance, 'presence': sensor_presence})
+        return jsonify({'datetime': sensor_datetime, 'distance': sensor_distance, 'presence': sensor_presence, 'spread': sensor_spread})
     else:
         return jsonify({'data': None})
 
@@ -559,18 +563,11 @@ def shutdown_server():
 
 if __name__ == "__main__":
     try:
-        for file in os.listdir(TEMP_DIR):
-            # try and read the file
-            try:
-                with open(os.path.join(TEMP_DIR, file), 'r') as f:
-                    pass
-                #move the file to the data directory
-                new_file_name = os.path.join(DATA_DIR, os.path.join(file.split('_')[1]),file.split('_')[2], f"{file}.csv")
-                os.rename(os.path.join(TEMP_DIR, file), new_file_name)
-                print(f"File {file} moved to {new_file_name}")
-            except:
-                # if the file is not readable, delete it
-                os.remove(os.path.join(TEMP_DIR, file))
+        # move the files left in the temp folder by a power loss to the data folder, cut back to their last journaled flush
+        try:
+            recover_temp_files(os.path.join(ROOT_DIR, TEMP_DIR), os.path.join(ROOT_DIR, DATA_DIR))
+        except Exception as e:
+            print(f"Could not recover the temp files: {e}")
         # #Delete content of the temp folder
         # subprocess.run(f"rm -rf {TEMP_DIR}/*", shell=True)
         # Create an empty queue
@@ -580,7 +577,8 @@ if __name__ == "__main__":
         
         led_thread = threading.Thread(target=pulsate_led, args=(led_status_queue, status_queue,))  # red led loop
         led_thread.start()
-        rtc = RTC.SDL_DS3231()
+        # the time is read from the DS3231 every few minutes and from the monotonic clock in between
+        rtc = RTC.CachedDS3231()
 
         # create and start threads
         data_thread = threading.Thread(target=read_write_loop, args=(rtc, led_status_queue, sensor_data_queue,))
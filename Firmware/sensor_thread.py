@@ -2,61 +2,117 @@
 import time
 import os
 from datetime import datetime, timedelta
-import csv
 import configparser
 import lib.human_presence as human_presence
 from lib.PiicoDev_VL53L1X import PiicoDev_VL53L1X
 import lib.battery as battery
 from shared_resources import FILE_HEADER, DATA_DIR, CONFIG_FILE, DEVICE_ID, TEMP_DIR, stop_event, lock, device_should_record, LOG_FILE,ROOT_DIR
 import logging
+from data_writer import BufferedSampleWriter, DeadbandEncoder, JOURNAL_FILE
 
-def write_data_to_file(fileName, data):
+def get_file_paths(ID, start):
     """
-    Write the data to a CSV file with the given file name.
+    Get the paths of a file started at the given time.
 
-    If the file already exists, the data will be appended to it.
+    The file is recorded in the temp folder and moved to data/<ID>/<yymmdd>/ when it is complete,
+    the writer adds the extension of its file format to the destination.
 
     Args:
-        fileName (str): The name of the file to write to.
-        data (list): A list of data to write to the file.
+        ID (str): The participant ID.
+        start (datetime): The time the file is started.
+
+    Returns:
+        tuple: The path of the file in the temp folder and its path in the data folder.
     """
-    # for folders in filename, create them if they don't exist  
-    path = "/"
-    fileName = os.path.normpath(fileName)
-    for folder in fileName.split(os.path.sep)[:-1]:
-        path = os.path.join(path, folder)
-        if not os.path.exists(path):
-            os.mkdir(path)
-            
-    mode = 'a' if os.path.exists(fileName) else 'w'
-    with open(fileName, mode, newline='') as f:
-        # Create a CSV writer object
-        writer = csv.writer(f)
+    formattedDatetime = start.strftime("%y%m%d_%H%M%S")
+    name = f"{DEVICE_ID}_{ID}_{formattedDatetime}"
+    tempPath = os.path.join(ROOT_DIR, TEMP_DIR, name)
+    destination = os.path.join(ROOT_DIR, DATA_DIR, ID, start.strftime("%y%m%d"), name)
+    return tempPath, destination
+
+def create_writer(config):
+    """
+    Create the writer of the recorded files from the configuration.
+
+    With COMPRESSION = deadband the samples are merged into runs that are written when the distance moves by more than DEADBAND mm,
+    the presence changes or HEARTBEAT_PERIOD seconds have passed (see data_writer.py).
+
+    Args:
+        config (configparser.ConfigParser): The configuration.
+
+    Returns:
+        BufferedSampleWriter: The writer, no file is open yet.
+    """
+    encoder = None
+    if config.get('DEFAULT', 'COMPRESSION', fallback='none') == 'deadband':
+        encoder = DeadbandEncoder(config.getint('DEFAULT', 'DEADBAND', fallback=10), config.getint('DEFAULT', 'HEARTBEAT_PERIOD', fallback=300))
+    return BufferedSampleWriter(os.path.join(ROOT_DIR, TEMP_DIR, JOURNAL_FILE),
+                                config.get('DEFAULT', 'FSYNC_POLICY', fallback='flush'),
+                                config.get('DEFAULT', 'FILE_FORMAT', fallback='csv'),
+                                encoder)
+
+def needs_new_file(FILE_ROTATION, NEW_FILE_PERIOD, fileStart, now):
+    """
+    Check whether the file being recorded should be closed and a new one started.
+
+    With FILE_ROTATION = daily a file holds a whole day: it is only rotated at midnight (and closed when the device stops recording),
+    its rows being made durable at every write by the journal of the writer. With FILE_ROTATION = period a new file is started every NEW_FILE_PERIOD seconds.
+
+    Args:
+        FILE_ROTATION (str): "daily" or "period".
+        NEW_FILE_PERIOD (int): The duration of a file in seconds, for the period rotation.
+        fileStart (datetime): The time the file was started.
+        now (datetime): The time of the next sample.
 
-        # Write the data to the CSV file
-        writer.writerows(data)
+    Returns:
+        bool: True if the next sample should go to a new file.
+    """
+    if FILE_ROTATION == 'daily':
+        return now.date() != fileStart.date()
+    return now - fileStart > timedelta(seconds=NEW_FILE_PERIOD)
 
-def create_folders(fileName):
+def get_presence_rows(events, lastRowTime, lastPresence, sampleTime):
     """
-    Create folders in the given file path if they don't exist.
+    Get the rows recording the changes of presence since the last row, the files keep whole seconds.
+
+    The changes are truncated to their second and only the last state of each second is kept, so a short absence
+    with both edges in the same second is not recorded as lasting until the next sample. A change in the second of
+    the last row is moved to the next second, a change in the second of the sample is left to the sample, and a state
+    equal to the presence already recorded is not written.
 
     Args:
-        fileName (str): The file path to create folders in.
+        events (list): The (datetime, presence) of each change, in time order.
+        lastRowTime (datetime): The time of the last row written, None if no row was written yet.
+        lastPresence (int): The presence of the last row written, None if no row was written yet.
+        sampleTime (datetime): The time of the sample, in whole seconds.
+
+    Returns:
+        list: The (datetime, presence) of the rows to write, in time order.
     """
-    path = "/"
-    fileName = os.path.normpath(fileName)
-    for folder in fileName.split(os.path.sep)[:-1]:
-        path = os.path.join(path, folder)
-        if not os.path.exists(path):
-            os.mkdir(path)
+    # second: last state of the second, the seconds are inserted in time order
+    states = {}
+    for eventTime, presence in events:
+        second = eventTime.replace(microsecond=0)
+        if lastRowTime is not None and second <= lastRowTime:
+            second = lastRowTime + timedelta(seconds=1)
+        states[second] = presence
+    rows = []
+    for second, presence in states.items():
+        if second >= sampleTime or presence == lastPresence:
+            continue
+        rows.append((second, presence))
+        lastPresence = presence
+    return rows
 
 def read_write_loop(rtc, status_queue, sensor_data_queue):
     """
-    Continuously read sensor data and write it to a CSV file.
+    Continuously read sensor data and write it to a file.
 
     This function reads sensor data from the human presence sensor and distance sensor, and stores
-    it in a list. The data is then written to a CSV file with the specified file name every `WRITE_PERIOD`
-    seconds.
+    it in a list. The data is then written to a CSV or binary file (FILE_FORMAT), optionally run length encoded (COMPRESSION), with the specified file name every `WRITE_PERIOD`
+    seconds, the file being recorded stays open between the writes (see data_writer.py).
+    A file is started with the first sample of a recording and holds a day (FILE_ROTATION = daily) or NEW_FILE_PERIOD seconds,
+    it is closed and moved to the data folder when it is rotated, when recording is stopped and at the end of the recording hours.
     """
     # logging.basicConfig(filename=LOG_FILE, level=logging.DEBUG, format='%(asctime)s %(message)s')
     # logging.info("sensor_thread: starting read_write_loop")
@@ -67,6 +123,8 @@ def read_write_loop(rtc, status_queue, sensor_data_queue):
         SAMPLING_PERIOD = config.getint('DEFAULT', 'SAMPLING_PERIOD')
         WRITE_PERIOD = config.getint('DEFAULT', 'WRITE_PERIOD')
         NEW_FILE_PERIOD = config.getint('DEFAULT', 'NEW_FILE_PERIOD')
+        FILE_ROTATION = config.get('DEFAULT', 'FILE_ROTATION', fallback='daily')
+        DISTANCE_BURST = config.getint('DEFAULT', 'DISTANCE_BURST', fallback=5)
         UPLOAD_PERIOD = config.getint('DEFAULT', 'UPLOAD_PERIOD')
         ID = config.get('DEFAULT', 'ID')
         WAKE_AT = config.get('DEFAULT', 'WAKE_AT')
@@ -75,18 +133,21 @@ def read_write_loop(rtc, status_queue, sensor_data_queue):
     # init sensors
     #print("setting up HDP sensor")
     human_presence.init_hdp()
+    # timestamp the changes of presence between the samples, they are written as extra rows
+    presenceWatcher = human_presence.PresenceWatcher(rtc)
+    presenceWatcher.start()
+    watchPresence = presenceWatcher.available()
+    lastDistance = float('nan')
+    lastPresence = None
+    lastRowTime = None
     #print("setting up Distance sensor")
     distSensor = PiicoDev_VL53L1X() 
    
 
-    # Initialize the list of data with the header
-    data = [FILE_HEADER]
-    # Compute the file name
+    # the first file is opened with the first sample, the rows are buffered and written every WRITE_PERIOD
+    writer = create_writer(config)
     lastWriteTime = rtc.read_datetime()
     lastNewFileTime = lastWriteTime
-    date = lastNewFileTime.strftime("%y%m%d")
-    formattedDatetime = lastNewFileTime.strftime("%y%m%d_%H%M%S")
-    fileName = os.path.join(ROOT_DIR,TEMP_DIR,f"{DEVICE_ID}_{ID}_{formattedDatetime}")  
     
     status_queue.append(("settingUp", False))
     
@@ -96,14 +157,9 @@ def read_write_loop(rtc, status_queue, sensor_data_queue):
     while True:
         if stop_event.is_set() and not stop: # the stop event has been set and we need to stop recording
             stop = True
-            # close the current file
-            write_data_to_file(fileName, data)
-            data = [FILE_HEADER]
+            # close the current file and move it from the temp folder to the data folder
+            writer.close()
             lastWriteTime = rtc.read_datetime()
-            # move the file from the temp folder to the data folder and rename it
-            newFilePath = os.path.join(ROOT_DIR,DATA_DIR,ID,date,f"{DEVICE_ID}_{ID}_{formattedDatetime}.csv")
-            create_folders(newFilePath)
-            os.rename(fileName,f"{newFilePath}")
             # logging.info("sensor_thread: stop event set, stopping recording")
 
             
@@ -113,16 +169,14 @@ def read_write_loop(rtc, status_queue, sensor_data_queue):
             SAMPLING_PERIOD = config.getint('DEFAULT', 'SAMPLING_PERIOD')
             WRITE_PERIOD = config.getint('DEFAULT', 'WRITE_PERIOD')
             NEW_FILE_PERIOD = config.getint('DEFAULT', 'NEW_FILE_PERIOD')
+            FILE_ROTATION = config.get('DEFAULT', 'FILE_ROTATION', fallback='daily')
+            DISTANCE_BURST = config.getint('DEFAULT', 'DISTANCE_BURST', fallback=5)
             ID = config.get('DEFAULT', 'ID')
             WAKE_AT = config.get('DEFAULT', 'WAKE_AT')
             SLEEP_AT = config.get('DEFAULT', 'SLEEP_AT')
             print("sensor_thread: stop event cleared, starting recording again")
-            # create a new file
-            now = rtc.read_datetime()
-            date = now.strftime("%y%m%d")
-            formattedDatetime = lastNewFileTime.strftime("%y%m%d_%H%M%S")
-            fileName = os.path.join(ROOT_DIR,TEMP_DIR,f"{DEVICE_ID}_{ID}_{formattedDatetime}")  
-            lastNewFileTime = now
+            # a new file is opened with the next sample
+            writer = create_writer(config)
             stop = False
             # logging.info("sensor_thread: stop event cleared, starting recording again")
     
@@ -130,51 +184,61 @@ def read_write_loop(rtc, status_queue, sensor_data_queue):
 
             status_queue.append(("recording", True))
 
+            # the changes of presence since the last sample, taken before the time of the sample so that they all precede it
+            presenceEvents = presenceWatcher.pop_events() if watchPresence else []
             # Read data from sensors
             with lock:
                 now = rtc.read_datetime()
                 last_sample = now
-            hp = human_presence.read_presence()
-            distance = distSensor.read()
+            # the watcher shares the value file of the pin, reading it here would hide an edge from the watcher
+            hp = presenceWatcher.value if watchPresence else human_presence.read_presence()
+            # median of DISTANCE_BURST measurements of the continuous ranging, the spread tells how much they disagreed
+            distance, spread = distSensor.read_burst(DISTANCE_BURST)
             battery_level = round(battery.compute_battery_level(),2)
-            # Append data to the list
-            line = [now, distance, hp]
-            data.append(line)
-            graph_data = [now, distance, hp, battery_level]
-            sensor_data_queue.append(graph_data)
 
-            # print("{now} {distance} {hp}".format(distance=distance, hp=hp, now=now))
-
-            elapsed = now - lastNewFileTime
-            if elapsed > timedelta(seconds=NEW_FILE_PERIOD): # create a new file
+            if writer.file is not None and needs_new_file(FILE_ROTATION, NEW_FILE_PERIOD, lastNewFileTime, now):
                 # logging.info("sensor_thread: creating new file")
-                # closed the last file
-                write_data_to_file(fileName, data)
-                data = [FILE_HEADER]
-                lastWriteTime = now
-                newFilePath = os.path.join(ROOT_DIR,DATA_DIR,ID,date,f"{DEVICE_ID}_{ID}_{formattedDatetime}.csv")
-                create_folders(newFilePath)
-                os.rename(fileName,f"{newFilePath}")
-                
-                # get new file name
-                date = now.strftime("%y%m%d")
-                formattedDatetime = lastNewFileTime.strftime("%y%m%d_%H%M%S")
-                fileName = os.path.join(ROOT_DIR,TEMP_DIR,f"{DEVICE_ID}_{ID}_{formattedDatetime}")  
+                # close the last file and move it to the data folder
+                writer.close()
+            if writer.file is None:
+                # the new file is named after the time it is started
+                writer.open(*get_file_paths(ID, now), FILE_HEADER)
                 lastNewFileTime = now
+                lastWriteTime = now
+
+            # Append data to the list, the files keep whole seconds
+            sampleTime = now.replace(microsecond=0)
+            # write the changes of presence with the last distance read
+            for eventTime, presence in get_presence_rows(presenceEvents, lastRowTime, lastPresence, sampleTime):
+                writer.append([eventTime, lastDistance, presence])
+            line = [sampleTime, distance, hp]
+            writer.append(line)
+            lastDistance = distance
+            lastPresence = hp
+            lastRowTime = sampleTime
+            graph_data = [sampleTime, distance, hp, battery_level, spread]
+            sensor_data_queue.append(graph_data)
+
+            # print("{now} {distance} {hp}".format(distance=distance, hp=hp, now=now))
                 
             # Write data to CSV file after set amount of time has elapsed
             elapsed = now - lastWriteTime
             if elapsed > timedelta(seconds=WRITE_PERIOD):
                 # logging.info("sensor_thread: writing data to file")
-                write_data_to_file(fileName, data)
-                # Reset data and time for the next write interval
-                data = []
+                writer.flush()
+                # Reset the time for the next write interval
                 lastWriteTime = now
 
             # Wait for the specified sampling period before collecting more data
             sleepFor = SAMPLING_PERIOD - (rtc.read_datetime() - last_sample).total_seconds()
             time.sleep(sleepFor if sleepFor > 0 else 0 )
         else:
+            if writer.file is not None:
+                # end of the recording hours, close the file so that it can be uploaded
+                writer.close()
+            if watchPresence:
+                # the changes while not recording are not written
+                presenceWatcher.pop_events()
             status_queue.append(("recording", False))
             #print(f"recording will wake in {seconds_until_wake()}")
             sleepFor = SAMPLING_PERIOD - (rtc.read_datetime() - last_sample).total_seconds()
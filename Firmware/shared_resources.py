@@ -13,6 +13,7 @@ ROOT_DIR = "/root/Firmware"
 TEMP_DIR = "temp"
 DATA_DIR = "data"
 FILE_HEADER = ["Date time", "Distance(mm)", "Human Present"]
+DATA_FILE_EXTENSIONS = (".csv", ".bin", ".csv.gz", ".bin.gz") # the extensions of the recorded files, CSV rows or binary records, gzipped before upload (see data_writer.py)
 CONFIG_FILE = "config.ini"
 LOG_FILE = "/root/Firmware/logs/standup.log"
 DEVICE_ID ='A17E' # this is the device ID of the device !- hardcoded for now
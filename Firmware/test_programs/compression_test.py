@@ -0,0 +1,36 @@
+"""
+File: compression_test.py
+Description: This script measures the CPU time the device spends to gzip the recorded files at each compression level against the bytes saved.
+             The files are compressed in memory, the data folder is left untouched.
+             Usage, from the Firmware folder: python -m test_programs.compression_test [data folder]
+"""
+try:
+    import os
+    import sys
+    import gzip
+    import time
+    from shared_resources import ROOT_DIR, DATA_DIR
+    from data_writer import UNCOMPRESSED_EXTENSIONS
+
+    folder = sys.argv[1] if len(sys.argv) > 1 else os.path.join(ROOT_DIR, DATA_DIR)
+    contents = []
+    for path, subdirs, files in os.walk(folder):
+        for name in files:
+            if name.endswith(UNCOMPRESSED_EXTENSIONS):
+                with open(os.path.join(path, name), 'rb') as f:
+                    contents.append(f.read())
+    totalSize = sum(len(content) for content in contents)
+    print(f"{len(contents)} files, {totalSize} bytes")
+    if totalSize == 0:
+        raise SystemExit("no recorded file to compress")
+
+    for level in (1, 6, 9):
+        start = time.process_time()
+        compressedSize = sum(len(gzip.compress(content, compresslevel=level, mtime=0)) for content in contents)
+        cpuTime = time.process_time() - start
+        saved = totalSize - compressedSize
+        print(f"level {level}: {compressedSize} bytes ({100 * compressedSize / totalSize:.1f}%), "
+              f"{cpuTime:.2f} s CPU, {1000 * cpuTime / len(contents):.1f} ms per file, {saved / 1024 / max(cpuTime, 1e-6):.0f} kB saved per CPU second")
+    print("OK")
+except Exception as e:
+    print(e)
@@ -0,0 +1,30 @@
+"""
+File: gpio_benchmark.py
+Description: This script measures the cost of a read of the HPD GPIO pin with OnionGpio, which exports and unexports the pin for every read,
+             against PersistentGpio, which keeps the pin exported and its value file open.
+             Usage, from the Firmware folder: python -m test_programs.gpio_benchmark [number of reads]
+"""
+try:
+    import sys
+    import time
+    import lib.onionGpio as onionGpio
+    from lib.human_presence import HPD_GPIO_PIN
+
+    numReads = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    def time_reads(gpioClass):
+        # a new object for every read, as in human_presence.read_presence
+        gpioClass(HPD_GPIO_PIN).getValue()
+        start = time.perf_counter()
+        for i in range(numReads):
+            gpioClass(HPD_GPIO_PIN).getValue()
+        return (time.perf_counter() - start) / numReads
+
+    onionTime = time_reads(onionGpio.OnionGpio)
+    persistentTime = time_reads(onionGpio.PersistentGpio)
+    onionGpio.PersistentGpio(HPD_GPIO_PIN).close()
+    print(f"OnionGpio:      {1e6 * onionTime:.1f} us per read")
+    print(f"PersistentGpio: {1e6 * persistentTime:.1f} us per read ({onionTime / persistentTime:.1f}x faster)")
+    print("OK")
+except Exception as e:
+    print(e)
@@ -0,0 +1,35 @@
+"""
+File: i2c_profile.py
+Description: This script profiles the I2C traffic of the sampling loop. It takes samples as sensor_thread does (the time from the RTC
+             and a burst of the distance sensor) and prints the transactions, bytes and errors of each device per sample,
+             from the counters of the shared I2C transport (see lib/PiicoDev_Unified.py).
+             Usage, from the Firmware folder: python -m test_programs.i2c_profile [number of samples] [distance burst]
+"""
+try:
+    import sys
+    import time
+    import lib.SDL_DS3231 as RTC
+    from lib.PiicoDev_VL53L1X import PiicoDev_VL53L1X
+    from lib.PiicoDev_Unified import get_i2c_transport
+
+    numSamples = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    distanceBurst = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    rtc = RTC.CachedDS3231()
+    distSensor = PiicoDev_VL53L1X()
+    transport = get_i2c_transport()
+    # leave out the setup of the devices
+    transport.reset_stats()
+
+    start = time.perf_counter()
+    for i in range(numSamples):
+        now = rtc.read_datetime()
+        distance, spread = distSensor.read_burst(distanceBurst)
+    elapsed = time.perf_counter() - start
+
+    print(f"{numSamples} samples, {1000 * elapsed / numSamples:.1f} ms per sample")
+    for address, stats in sorted(transport.get_stats().items()):
+        print(f"device 0x{address:02X}: " + ", ".join(f"{stats[name] / numSamples:.1f} {name}" for name in stats) + " per sample")
+    print("OK")
+except Exception as e:
+    print(e)
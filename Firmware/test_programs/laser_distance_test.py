@@ -1,6 +1,6 @@
 """
 File: laser_distance_test.py
-Description: This script tests the PiicoDev VL53L1X Time-of-Flight Distance Sensor by reading the distance.
+Description: This script tests the PiicoDev VL53L1X Time-of-Flight Distance Sensor by reading the distance, alone and as the median of a burst of the continuous ranging.
 Author: Sami Kaab
 Date: 2023-07-05
 """
@@ -11,7 +11,8 @@ try:
     distSensor = PiicoDev_VL53L1X() 
     for i in range(10):
         distance = distSensor.read()
-        print(distance)
+        median, spread = distSensor.read_burst(5)
+        print(f"{distance} mm, burst median {median} mm, spread {spread} mm")
         sleep(1)
     print("OK")
 
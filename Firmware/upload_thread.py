@@ -4,6 +4,7 @@ import os
 import time
 import configparser
 import backup_to_drive as google_drive
+from data_writer import compress_data_files
 from shared_resources import FILE_HEADER, ROOT_DIR, DATA_DIR, TEMP_DIR, CONFIG_FILE,stop_event, lock, device_should_record,LOG_FILE,DEVICE_ID
 import subprocess
 import logging
@@ -34,7 +35,8 @@ def upload_loop(rtc, status_queue):
     Periodically upload the sensor data to Google Drive.
 
     This function checks for an internet connection and, if available, updates the real-time clock (RTC)
-    module with the current time from the internet. It then backs up the sensor data to Google Drive.
+    module with the current time from the internet. It then backs up the sensor data to Google Drive,
+    after compressing the closed files if UPLOAD_COMPRESSION is gzip.
     The status of the backup process is indicated using the red LED.
 
     Returns:
@@ -58,6 +60,7 @@ def upload_loop(rtc, status_queue):
         config = configparser.ConfigParser()
         config.read(CONFIG_FILE)
         UPLOAD_PERIOD = config.getint('DEFAULT', 'UPLOAD_PERIOD')
+        UPLOAD_COMPRESSION = config.get('DEFAULT', 'UPLOAD_COMPRESSION', fallback='none')
         WAKE_AT = config.get('DEFAULT', 'WAKE_AT')
         SLEEP_AT = config.get('DEFAULT', 'SLEEP_AT')
         ID = config.get('DEFAULT', 'ID')
@@ -102,6 +105,7 @@ def upload_loop(rtc, status_queue):
             config = configparser.ConfigParser()
             config.read(CONFIG_FILE)
             UPLOAD_PERIOD = config.getint('DEFAULT', 'UPLOAD_PERIOD')
+            UPLOAD_COMPRESSION = config.get('DEFAULT', 'UPLOAD_COMPRESSION', fallback='none')
             WAKE_AT = config.get('DEFAULT', 'WAKE_AT')
             SLEEP_AT = config.get('DEFAULT', 'SLEEP_AT')
             ID = config.get('DEFAULT', 'ID')
@@ -131,6 +135,9 @@ def upload_loop(rtc, status_queue):
             
         if (rtc.read_datetime() - last_upload_try).total_seconds() > UPLOAD_PERIOD:
             last_upload_try = rtc.read_datetime()
+            # compress the files closed since the last try, also when offline to save space on the flash
+            if UPLOAD_COMPRESSION == 'gzip':
+                compress_data_files(os.path.join(ROOT_DIR, DATA_DIR))
             internet = google_drive.is_internet_available()
             if internet:
                 dt = get_time_from_internet()